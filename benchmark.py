@@ -0,0 +1,371 @@
+"""Banco de pruebas de rendimiento de main.py.
+
+Siembra una base de datos (SQLite temporal por defecto, o la indicada con
+--db-url) con clases, mantenimientos y evidencias con imágenes sintéticas,
+sustituye la IA por respuestas fijas y mide las rutas principales con el
+cliente de pruebas de Flask, lanzando las peticiones desde varios hilos a la
+vez. El resultado es un JSON con p50/p95/p99, rendimiento y RSS máximo por
+escenario, pensado para comparar entre commits:
+
+    python benchmark.py --mantenimientos 10000 --peticiones 300 --concurrencia 8 --salida bench.json
+
+Todo se escribe en un directorio temporal; la base de datos indicada con
+--db-url solo se vacía y se vuelve a sembrar si se pasa --reiniciar-bd. Para
+reutilizar una base ya sembrada hay que indicar con --archivos la carpeta de
+evidencias y reportes de aquella siembra:
+
+    python benchmark.py --db-url postgresql://localhost/bench --reiniciar-bd --archivos /srv/bench
+    python benchmark.py --db-url postgresql://localhost/bench --archivos /srv/bench
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+ESCENARIOS = ("listado", "listado_filtrado", "busqueda", "guardar", "reporte", "descarga")
+
+INFO_ESTRUCTURADA = json.dumps({
+    "strTituloDocumento": "INFORME de mantenimiento de prueba",
+    "strTituloMantenimiento": "INFORME DE MANTENIMIENTO PREVENTIVO",
+    "strActividad": "Mantenimiento preventivo.",
+    "strAlcance": "Mantenimiento preventivo programado.",
+    "strEstado": "El equipo se encontraba operativo.",
+    "strEstadoEquipo": "Sin observaciones.",
+    "listTrabajosPrevios": ["Coordinar con producción la parada del equipo."],
+    "listActividades": [{"strSubActividad": "INSPECCIÓN GENERAL.", "listSubActividad": ["Se realizó la inspección."]}],
+    "listConclusiones": ["Equipo operativo."],
+})
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-url", default=None, help="URL de SQLAlchemy; por defecto, SQLite en el directorio temporal.")
+    parser.add_argument("--reiniciar-bd", action="store_true", help="Borra y vuelve a sembrar la base de datos de --db-url.")
+    parser.add_argument("--archivos", default=None,
+                        help="Carpeta persistente para uploads/ y generated_reports/ (por defecto, el directorio temporal); "
+                             "obligatoria para reutilizar --db-url sin --reiniciar-bd.")
+    parser.add_argument("--clases", type=int, default=10)
+    parser.add_argument("--mantenimientos", type=int, default=1000)
+    parser.add_argument("--evidencias-por-mantenimiento", type=int, default=2)
+    parser.add_argument("--imagenes-distintas", type=int, default=20, help="Imágenes sintéticas compartidas por las evidencias.")
+    parser.add_argument("--lado-imagen", type=int, default=1600, help="Lado en píxeles de las imágenes sintéticas.")
+    parser.add_argument("--peticiones", type=int, default=200, help="Peticiones por escenario.")
+    parser.add_argument("--concurrencia", type=int, default=4, help="Hilos que lanzan peticiones a la vez.")
+    parser.add_argument("--escenarios", default=",".join(ESCENARIOS), help=f"Lista separada por comas de: {', '.join(ESCENARIOS)}.")
+    parser.add_argument("--semilla", type=int, default=1234)
+    parser.add_argument("--salida", default=None, help="Archivo JSON de resultados (por defecto, la salida estándar).")
+    return parser.parse_args()
+
+
+def _preparar_entorno(args, directorio):
+    """Configura el entorno antes de importar main: base de datos en el directorio temporal e IA simulada."""
+    os.environ["DATABASE_URL"] = args.db_url or f"sqlite:///{os.path.join(directorio, 'benchmark.db')}"
+    os.environ["GEMINI_API_KEY"] = ""
+    os.environ["IA_BACKEND"] = "falso"
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.chdir(directorio)
+    sys.path.insert(0, RAIZ)
+
+
+def _imagen_sintetica(rng, lado):
+    """JPEG con ruido, para que pese y se comprima como una foto real."""
+    from PIL import Image
+    imagen = Image.frombytes("RGB", (lado, lado * 3 // 4), rng.randbytes(lado * (lado * 3 // 4) * 3))
+    salida = io.BytesIO()
+    imagen.save(salida, "JPEG", quality=85)
+    return salida.getvalue()
+
+
+def _sembrar(main, app, args, rng):
+    db = main.db
+    if args.db_url and args.reiniciar_bd:
+        db.drop_all()
+    db.create_all()
+    main._asegurar_busqueda()
+
+    clases = [main.Clase(nombre=f"CLASE {i + 1}") for i in range(args.clases)]
+    db.session.add_all(clases)
+    db.session.commit()
+    ids_clases = [c.id for c in clases]
+
+    # Las evidencias comparten un conjunto pequeño de imágenes, igual que en el almacenamiento por hash.
+    nombres_imagenes = []
+    for _ in range(args.imagenes_distintas):
+        contenido = _imagen_sintetica(rng, args.lado_imagen)
+        nombre = f"{hashlib.sha256(contenido).hexdigest()}.jpg"
+        with open(os.path.join(app.config['UPLOAD_FOLDER'], nombre), "wb") as f:
+            f.write(contenido)
+        main.generar_variantes_evidencia(nombre)
+        nombres_imagenes.append(nombre)
+
+    tabla = main.Mantenimiento.__table__
+    ahora = main._ahora_utc()
+    lote = []
+    for i in range(args.mantenimientos):
+        realizado = rng.random() < 0.6
+        lote.append({
+            "area": main.AREAS[i % len(main.AREAS)], "locacion": f"EA-{rng.randint(1, 999)}",
+            "tipo_mantenimiento": rng.choice(["Preventivo", "Correctivo"]),
+            "descripcion_activo": f"Motor AJAX {rng.randint(1, 99)} bomba {i}",
+            "codigo_mantenimiento": f"BENCH-{i}", "mes_programado": rng.randint(1, 12),
+            "clase_id": rng.choice(ids_clases), "estado": "Realizado" if realizado else "Programado",
+            "fecha_realizacion": date(2024, 1, 1) + timedelta(days=rng.randint(0, 364)) if realizado else None,
+            "detalle_mantenimiento_sistema": "Se realizó el cambio de empaquetadura y la limpieza del carter." if realizado else None,
+            "informacion_estructurada": INFO_ESTRUCTURADA if realizado else None,
+            "autor": "Técnico" if realizado else None, "supervisor": "Supervisor" if realizado else None,
+            "actualizado_en": ahora,
+        })
+        if len(lote) == 5000:
+            db.session.execute(tabla.insert(), lote)
+            lote = []
+    if lote:
+        db.session.execute(tabla.insert(), lote)
+    db.session.commit()
+
+    ids = [id for (id,) in db.session.query(main.Mantenimiento.id)]
+    evidencias = [
+        {"nombre_archivo": rng.choice(nombres_imagenes), "mantenimiento_id": id}
+        for id in ids for _ in range(args.evidencias_por_mantenimiento)
+    ]
+    for inicio in range(0, len(evidencias), 5000):
+        db.session.execute(main.Evidencia.__table__.insert(), evidencias[inicio:inicio + 5000])
+    db.session.commit()
+    main.reconstruir_resumen()
+    return nombres_imagenes
+
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return None
+    indice = min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados))) - 1))
+    return ordenados[indice]
+
+
+def _ms(segundos):
+    return round(segundos * 1000, 2) if segundos is not None else None
+
+
+def _rss_pico_mb():
+    # ru_maxrss está en KB en Linux y en bytes en macOS.
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maximo / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _configuracion(directorio, archivos=None):
+    """Carpetas absolutas: servir_archivo las resuelve contra la raíz de la aplicación, no contra el cwd."""
+    return {
+        "UPLOAD_FOLDER": os.path.join(archivos or directorio, "uploads"),
+        "GENERATED_REPORTS_FOLDER": os.path.join(archivos or directorio, "generated_reports"),
+        "WORD_TEMPLATE_FOLDER": os.path.join(RAIZ, "word_templates"),
+        "PERFIL_CARPETA": os.path.join(directorio, "perfiles"),
+    }
+
+
+def _fallo(respuesta, esperado):
+    """None si la respuesta tiene el código esperado; si no, la descripción del fallo."""
+    if respuesta.status_code == esperado:
+        return None
+    return f"HTTP {respuesta.status_code} en {respuesta.request.method} {respuesta.request.path} (se esperaba {esperado})"
+
+
+def _ejecutar_escenario(app, peticion, total, concurrencia):
+    """Lanza `total` llamadas a peticion(cliente, i) desde `concurrencia` hilos y resume las latencias.
+
+    Las latencias solo incluyen las peticiones correctas; un escenario sin ninguna se marca como no válido.
+    """
+    locales = threading.local()
+    latencias, fallos = [], []
+    lock = threading.Lock()
+
+    def una(i):
+        if not hasattr(locales, "cliente"):
+            locales.cliente = app.test_client()
+        inicio = time.perf_counter()
+        try:
+            error = peticion(locales.cliente, i)
+        except Exception as e:
+            error = repr(e)
+        duracion = time.perf_counter() - inicio
+        with lock:
+            if error:
+                fallos.append(error)
+            else:
+                latencias.append(duracion)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        list(pool.map(una, range(total)))
+    duracion_total = time.perf_counter() - inicio
+
+    ordenadas = sorted(latencias)
+    return {
+        "valido": bool(ordenadas),
+        "peticiones": total,
+        "concurrencia": concurrencia,
+        "errores": len(fallos),
+        "ejemplo_error": fallos[0] if fallos else None,
+        "p50_ms": _ms(_percentil(ordenadas, 50)),
+        "p95_ms": _ms(_percentil(ordenadas, 95)),
+        "p99_ms": _ms(_percentil(ordenadas, 99)),
+        "media_ms": _ms(sum(ordenadas) / len(ordenadas) if ordenadas else None),
+        "rendimiento_rps": round(len(ordenadas) / duracion_total, 2),
+        "duracion_s": round(duracion_total, 3),
+        "rss_pico_mb": _rss_pico_mb(),
+    }
+
+
+def _peticiones(main, app, args, nombres_imagenes, rng):
+    """Una función por escenario: recibe (cliente, i) y devuelve None o la descripción del fallo."""
+    with app.app_context():
+        ids_con_datos = [id for (id,) in main.db.session.query(main.Mantenimiento.id)
+                         .filter(main.Mantenimiento.informacion_estructurada.isnot(None))]
+        id_clase = main.db.session.query(main.Clase.id).first()[0]
+    imagenes = []
+    for nombre in nombres_imagenes[:3]:
+        with open(os.path.join(app.config['UPLOAD_FOLDER'], nombre), "rb") as f:
+            imagenes.append(f.read())
+    reportes = []
+
+    def listado(cliente, i):
+        return _fallo(cliente.get("/"), 200)
+
+    def listado_filtrado(cliente, i):
+        return _fallo(cliente.get("/", query_string={"mes": i % 12 + 1, "area": main.AREAS[i % len(main.AREAS)]}), 200)
+
+    def busqueda(cliente, i):
+        return _fallo(cliente.get("/", query_string={"q": rng.choice(["empaquetadura", "motor ajax", "limpieza carter"])}), 200)
+
+    def guardar(cliente, i):
+        datos = {
+            "area": main.AREAS[i % len(main.AREAS)], "clase_id": str(id_clase), "tipo_mantenimiento": "Preventivo",
+            "locacion": "EA-1", "descripcion_activo": f"Equipo nuevo {i}", "codigo_mantenimiento": f"NUEVO-{i}",
+            "mes_programado": str(i % 12 + 1), "estado": "Programado", "fecha_realizacion": "",
+            "evidencias": [(io.BytesIO(contenido), f"foto{n}.jpg") for n, contenido in enumerate(imagenes)],
+        }
+        return _fallo(cliente.post("/guardar", data=datos, content_type="multipart/form-data"), 302)
+
+    def reporte(cliente, i):
+        # Incluye la espera del trabajo en segundo plano, que es lo que percibe el usuario.
+        id = ids_con_datos[i % len(ids_con_datos)]
+        respuesta = cliente.post(f"/generar-reporte-word/{id}")
+        if respuesta.status_code not in (200, 202):
+            return _fallo(respuesta, 202)
+        trabajo = respuesta.get_json()
+        while trabajo.get("estado") not in ("completado", "error"):
+            time.sleep(0.01)
+            respuesta = cliente.get(trabajo["url_estado"])
+            if respuesta.status_code != 200:
+                return _fallo(respuesta, 200)
+            trabajo = respuesta.get_json()
+        if trabajo["estado"] == "completado":
+            reportes.append(trabajo["filename"])
+            return None
+        return f"Trabajo de reporte con error: {trabajo['error']}"
+
+    def descarga(cliente, i):
+        if not reportes:
+            with app.app_context():
+                reportes.extend(n for (n,) in main.db.session.query(main.Mantenimiento.nombre_archivo_reporte)
+                                .filter(main.Mantenimiento.nombre_archivo_reporte.isnot(None)))
+        if not reportes:
+            raise RuntimeError("No hay reportes generados: ejecuta antes el escenario 'reporte'.")
+        return _fallo(cliente.get(f"/descargar-reporte/{reportes[i % len(reportes)]}"), 200)
+
+    return {"listado": listado, "listado_filtrado": listado_filtrado, "busqueda": busqueda,
+            "guardar": guardar, "reporte": reporte, "descarga": descarga}
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ejecutar():
+    args = _argumentos()
+    escenarios = [e.strip() for e in args.escenarios.split(",") if e.strip()]
+    desconocidos = [e for e in escenarios if e not in ESCENARIOS]
+    if desconocidos:
+        sys.exit(f"Escenarios desconocidos: {', '.join(desconocidos)}")
+
+    reutilizar_bd = bool(args.db_url and not args.reiniciar_bd)
+    if reutilizar_bd and not args.archivos:
+        sys.exit("Para reutilizar la base de --db-url sin --reiniciar-bd indica con --archivos "
+                 "la carpeta de evidencias y reportes de la siembra anterior.")
+    archivos = os.path.abspath(args.archivos) if args.archivos else None
+
+    rng = random.Random(args.semilla)
+    directorio = tempfile.mkdtemp(prefix="benchmark-mantenimientos-")
+    try:
+        _preparar_entorno(args, directorio)
+        import main as aplicacion
+        # La IA no interviene en lo que se mide: respuesta fija sin pasar por caché ni red.
+        aplicacion.call_gemini_api = lambda prompt: aplicacion.BackendIAFalso()._texto(prompt)
+
+        app = aplicacion.create_app(_configuracion(directorio, archivos))
+
+        inicio_siembra = time.perf_counter()
+        with app.app_context():
+            if reutilizar_bd:
+                nombres_imagenes = [e.nombre_archivo for e in aplicacion.Evidencia.query.limit(3)]
+                faltan = sorted({n for n in nombres_imagenes
+                                 if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], n))})
+                if faltan:
+                    sys.exit(f"Faltan evidencias de la base reutilizada en {app.config['UPLOAD_FOLDER']}: "
+                             f"{', '.join(faltan)}. ¿Es la carpeta --archivos de la siembra?")
+            else:
+                nombres_imagenes = _sembrar(aplicacion, app, args, rng)
+            dialecto = aplicacion.db.engine.dialect.name
+        duracion_siembra = time.perf_counter() - inicio_siembra
+
+        peticiones = _peticiones(aplicacion, app, args, nombres_imagenes, rng)
+        resultados = {}
+        for nombre in escenarios:
+            resultados[nombre] = _ejecutar_escenario(app, peticiones[nombre], args.peticiones, args.concurrencia)
+            print(f"{nombre}: p50={resultados[nombre]['p50_ms']} ms, p95={resultados[nombre]['p95_ms']} ms, "
+                  f"{resultados[nombre]['rendimiento_rps']} pet/s, {resultados[nombre]['errores']} errores", file=sys.stderr)
+
+        informe = {
+            "commit": _commit_actual(),
+            "python": sys.version.split()[0],
+            "base_de_datos": dialecto,
+            "datos": {
+                "clases": args.clases, "mantenimientos": args.mantenimientos,
+                "evidencias_por_mantenimiento": args.evidencias_por_mantenimiento,
+                "imagenes_distintas": args.imagenes_distintas, "siembra_s": round(duracion_siembra, 2),
+            },
+            "escenarios": resultados,
+            "rss_pico_mb": _rss_pico_mb(),
+        }
+    finally:
+        os.chdir(RAIZ)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+    no_validos = [nombre for nombre, resultado in resultados.items() if not resultado["valido"]]
+    if no_validos:
+        sys.exit(f"Escenarios sin ninguna respuesta correcta: {', '.join(no_validos)}")
+
+
+if __name__ == "__main__":
+    ejecutar()
@@ -1,49 +1,327 @@
-from flask import Flask, render_template, request, redirect, url_for, abort, flash, send_from_directory, jsonify
+from flask import Flask, Blueprint, current_app, render_template, request, redirect, url_for, abort, flash, jsonify, Response, stream_with_context, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from markupsafe import Markup, escape
 from dotenv import load_dotenv
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, send_from_directory as werkzeug_send_from_directory
+from urllib.parse import quote
 import os
 import uuid
 import json
-import google.genai as genai
-from google.genai import types
-from docxtpl import DocxTemplate, InlineImage
-from docx.shared import Cm, Inches
+import io
+import copy
+import hashlib
+import re
+import zipfile
+import multiprocessing
+import click
+import csv
+import itertools
+import unicodedata
+import tempfile
+try:
+    import fcntl
+except ImportError:  # Windows: el bloqueo de blobs solo cubre los hilos del proceso
+    fcntl = None
+import sys
 import logging
-from datetime import date
+import cProfile
+from contextlib import contextmanager
+import threading
+import queue
+import time
+import random
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta, timezone
 
-load_dotenv()
+GEMINI_MODEL = "gemini-2.5-flash-lite"
 
-app = Flask(__name__)
+db = SQLAlchemy()
 
-app.config['WORD_TEMPLATE_FOLDER'] = 'word_templates'
-app.config['GENERATED_REPORTS_FOLDER'] = 'generated_reports'
-os.makedirs(app.config['GENERATED_REPORTS_FOLDER'], exist_ok=True)
+# Todas las rutas y comandos CLI cuelgan de este blueprint; create_app() lo registra.
+bp = Blueprint('principal', __name__, cli_group=None)
+
+# Módulos pesados que cada subsistema importa la primera vez que se usa
+# (medir_arranque.py comprueba que no se carguen al arrancar).
+SUBSISTEMAS_PEREZOSOS = {
+    "ia": ("google.genai", "httpx"),
+    "reportes": ("docxtpl", "docx"),
+    "imagenes": ("PIL.Image",),
+}
 
-logging.basicConfig(level=logging.INFO)
 
 # --- CONFIGURACIÓN ---
-# 1. Clave secreta para notificaciones flash
-app.secret_key = os.getenv("SECRET_KEY")
 
-# 2. Configuración de la carpeta de subidas
-app.config['UPLOAD_FOLDER'] = 'uploads'
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True) # Asegura que la carpeta exista
+def create_app(config=None):
+    """Crea la aplicación leyendo la configuración del entorno (`config` la sobrescribe).
+
+    Importar este módulo no carga el cliente de Gemini, docxtpl/python-docx ni
+    Pillow: cada subsistema se importa e inicializa la primera vez que se usa.
+    Con gunicorn: `gunicorn 'main:create_app()'` (con o sin --preload).
+    """
+    load_dotenv()
+
+    app = Flask(__name__)
+
+    app.config['WORD_TEMPLATE_FOLDER'] = 'word_templates'
+    app.config['GENERATED_REPORTS_FOLDER'] = 'generated_reports'
+    # Número máximo de reportes Word que se generan en paralelo
+    app.config['REPORTES_MAX_TRABAJOS'] = int(os.getenv("REPORTES_MAX_TRABAJOS", 2))
+    # Procesos usados para renderizar en paralelo durante la exportación masiva
+    app.config['REPORTES_MAX_PROCESOS'] = int(os.getenv("REPORTES_MAX_PROCESOS", os.cpu_count() or 2))
+
+    # 1. Clave secreta para notificaciones flash
+    app.secret_key = os.getenv("SECRET_KEY")
+
+    # 2. Configuración de la carpeta de subidas
+    app.config['UPLOAD_FOLDER'] = 'uploads'
+    # Tamaño (lado mayor, en píxeles) y calidad JPEG de las variantes de cada evidencia
+    app.config['EVIDENCIA_LADO_REPORTE'] = int(os.getenv("EVIDENCIA_LADO_REPORTE", 1280))
+    app.config['EVIDENCIA_LADO_MINIATURA'] = int(os.getenv("EVIDENCIA_LADO_MINIATURA", 320))
+    app.config['EVIDENCIA_CALIDAD_JPEG'] = int(os.getenv("EVIDENCIA_CALIDAD_JPEG", 82))
+    # Segundos desde la última subida durante los que un blob sin referencias no se borra
+    # (la fila de Evidencia que lo reutiliza puede no estar confirmada todavía)
+    app.config['EVIDENCIA_GRACIA_LIMPIEZA'] = int(os.getenv("EVIDENCIA_GRACIA_LIMPIEZA", 600))
+
+    # Entrega de archivos por el servidor web: prefijo de la location interna de nginx
+    # (X-Accel-Redirect), o X-Sendfile para Apache/lighttpd
+    app.config['X_ACCEL_PREFIJO'] = os.getenv("X_ACCEL_PREFIJO", "")
+    app.config['USE_X_SENDFILE'] = os.getenv("USE_X_SENDFILE", "").lower() in ("1", "true", "si")
+
+    # 3. Configuración de la base de datos PostgreSQL
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL")
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    # 4. Configuración de la API de Gemini
+    app.config['GEMINI_API_KEY'] = os.getenv("GEMINI_API_KEY")
+    # Backend de IA: "gemini" o "falso" (respuestas simuladas, para pruebas sin conexión)
+    app.config['IA_BACKEND'] = os.getenv("IA_BACKEND", "gemini")
+    # Llamadas salientes simultáneas y segundos máximos de espera por un cupo
+    app.config['IA_MAX_CONCURRENTES'] = int(os.getenv("IA_MAX_CONCURRENTES", 4))
+    app.config['IA_ESPERA_CUPO'] = float(os.getenv("IA_ESPERA_CUPO", 2))
+    # Plazo de cada intento y plazo total (con reintentos) de una llamada, en segundos
+    app.config['IA_TIMEOUT'] = float(os.getenv("IA_TIMEOUT", 30))
+    app.config['IA_PLAZO_TOTAL'] = float(os.getenv("IA_PLAZO_TOTAL", 60))
+    # Reintentos ante errores transitorios, con espera exponencial aleatoria a partir de la base
+    app.config['IA_REINTENTOS'] = int(os.getenv("IA_REINTENTOS", 2))
+    app.config['IA_ESPERA_BASE'] = float(os.getenv("IA_ESPERA_BASE", 0.5))
+    # Cortacircuitos: fallos seguidos que lo abren y segundos que permanece abierto
+    app.config['IA_CIRCUITO_FALLOS'] = int(os.getenv("IA_CIRCUITO_FALLOS", 5))
+    app.config['IA_CIRCUITO_ENFRIAMIENTO'] = float(os.getenv("IA_CIRCUITO_ENFRIAMIENTO", 30))
+    # Caché de respuestas: entradas en memoria (LRU) y vigencia en segundos de cada respuesta
+    app.config['IA_CACHE_MAX_MEMORIA'] = int(os.getenv("IA_CACHE_MAX_MEMORIA", 256))
+    app.config['IA_CACHE_TTL'] = int(os.getenv("IA_CACHE_TTL", 7 * 24 * 3600))
+
+    # 5. API JSON: máximo de mantenimientos por lote de escritura y por página de lectura
+    app.config['API_MAX_LOTE'] = int(os.getenv("API_MAX_LOTE", 500))
+    # Segundos que se restan a 'sincronizado_en': actualizado_en se fija al hacer flush, antes
+    # del commit, y una transacción lenta puede confirmarse con una marca ya entregada
+    app.config['API_MARGEN_SINCRONIZACION'] = int(os.getenv("API_MARGEN_SINCRONIZACION", 300))
+
+    # 6. Perfilado de peticiones: "" (desactivado), "cabecera" (solo las que envían
+    # X-Perfilar: 1) o "todas"; se guarda el perfil de las que tardan más del umbral
+    app.config['PERFIL_MODO'] = os.getenv("PERFIL_MODO", "")
+    app.config['PERFIL_UMBRAL'] = float(os.getenv("PERFIL_UMBRAL", 1.0))
+    app.config['PERFIL_CARPETA'] = os.getenv("PERFIL_CARPETA", "perfiles")
+
+    if config:
+        app.config.update(config)
+
+    os.makedirs(app.config['GENERATED_REPORTS_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True) # Asegura que la carpeta exista
+    logging.basicConfig(level=logging.INFO)
+
+    db.init_app(app)
+    app.register_blueprint(bp)
+    return app
+
+
+# --- MÉTRICAS (FORMATO PROMETHEUS) Y PERFILADO ---
+# Métricas en memoria del proceso: con varios workers cada uno expone las suyas
+# en /metrics y Prometheus las agrega. Los renders que corren en el pool de
+# procesos de la exportación ZIP no se registran.
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+BUCKETS_BYTES = (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+
+def _escapar_etiqueta(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _etiquetas_prometheus(nombres, valores, le=None):
+    pares = [f'{n}="{_escapar_etiqueta(v)}"' for n, v in zip(nombres, valores)]
+    if le is not None:
+        pares.append(f'le="{le}"')
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def incrementar(self, cantidad=1, **etiquetas):
+        clave = tuple(etiquetas.get(e, "") for e in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            for clave, valor in sorted(self._valores.items()):
+                lineas.append(f"{self.nombre}{_etiquetas_prometheus(self.etiquetas, clave)} {valor}")
+        return lineas
+
+class Histograma:
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre, self.ayuda, self.etiquetas, self.buckets = nombre, ayuda, tuple(etiquetas), tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(etiquetas.get(e, "") for e in self.etiquetas)
+        with self._lock:
+            serie = self._series.setdefault(clave, {"buckets": [0] * len(self.buckets), "suma": 0.0, "cuenta": 0})
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie["buckets"][i] += 1
+            serie["suma"] += valor
+            serie["cuenta"] += 1
+
+    @contextmanager
+    def cronometrar(self, **etiquetas):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def exportar(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            for clave, serie in sorted(self._series.items()):
+                for limite, cuenta in zip(self.buckets, serie["buckets"]):
+                    lineas.append(f"{self.nombre}_bucket{_etiquetas_prometheus(self.etiquetas, clave, limite)} {cuenta}")
+                lineas.append(f"{self.nombre}_bucket{_etiquetas_prometheus(self.etiquetas, clave, '+Inf')} {serie['cuenta']}")
+                lineas.append(f"{self.nombre}_sum{_etiquetas_prometheus(self.etiquetas, clave)} {serie['suma']}")
+                lineas.append(f"{self.nombre}_count{_etiquetas_prometheus(self.etiquetas, clave)} {serie['cuenta']}")
+        return lineas
+
+METRICAS = {
+    "peticiones": Histograma("http_request_duration_seconds", "Duración de las peticiones HTTP.", ("metodo", "ruta", "estado")),
+    "consultas_peticion": Histograma("http_request_sql_queries", "Consultas SQL ejecutadas por petición.", ("ruta",), BUCKETS_CONSULTAS),
+    "sql_peticion": Histograma("http_request_sql_duration_seconds", "Tiempo total en SQL por petición.", ("ruta",)),
+    "sql": Histograma("sql_query_duration_seconds", "Duración de cada consulta SQL."),
+    "ia": Histograma("ia_llamada_duration_seconds", "Duración de cada intento de llamada a la IA.", ("modo", "resultado")),
+    "reporte_render": Histograma("reporte_render_duration_seconds", "Tiempo de renderizado de la plantilla Word."),
+    "reporte_guardado": Histograma("reporte_guardado_duration_seconds", "Tiempo de escritura del .docx a disco."),
+    "subida_bytes": Histograma("evidencia_subida_bytes", "Tamaño de cada evidencia subida.", buckets=BUCKETS_BYTES),
+    "subida": Histograma("evidencia_subida_duration_seconds", "Tiempo de recepción, hash y guardado de cada evidencia."),
+    "perfiles": Contador("perfiles_guardados_total", "Perfiles cProfile guardados de peticiones lentas."),
+}
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _antes_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("inicio_consulta", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _despues_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    duracion = time.perf_counter() - conn.info["inicio_consulta"].pop()
+    METRICAS["sql"].observar(duracion)
+    if has_request_context() and "consultas_sql" in g:
+        g.consultas_sql += 1
+        g.tiempo_sql += duracion
+
+def _ruta_metricas():
+    """Patrón de la ruta (no la URL) para que los ids no multipliquen las series."""
+    return request.url_rule.rule if request.url_rule else "sin_ruta"
+
+# Solo puede haber un perfilador activo por proceso (desde Python 3.12 enable() falla
+# con ValueError si hay otro): las peticiones concurrentes no se muestrean.
+_perfilador_lock = threading.Lock()
+
+def _detener_perfil():
+    """Desactiva el perfil de la petición actual, si lo hay, y libera el perfilador."""
+    perfil = g.pop("perfil", None)
+    if perfil:
+        perfil.disable()
+        _perfilador_lock.release()
+    return perfil
+
+@bp.before_app_request
+def _iniciar_medicion():
+    g.inicio_peticion = time.perf_counter()
+    g.consultas_sql = 0
+    g.tiempo_sql = 0.0
+    modo = current_app.config['PERFIL_MODO']
+    if modo == "todas" or (modo == "cabecera" and request.headers.get("X-Perfilar") == "1"):
+        if not _perfilador_lock.acquire(blocking=False):
+            return
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:
+            # Otra herramienta (p. ej. un depurador) ya está perfilando el proceso.
+            _perfilador_lock.release()
+            return
+        g.perfil = perfil
+
+@bp.after_app_request
+def _registrar_medicion(response):
+    """Registra duración y SQL de la petición y los expone también en Server-Timing.
+
+    En respuestas en streaming se mide hasta que la vista devuelve, no hasta el último byte.
+    """
+    if "inicio_peticion" not in g:
+        return response
+    duracion = time.perf_counter() - g.inicio_peticion
+    ruta = _ruta_metricas()
+    METRICAS["peticiones"].observar(duracion, metodo=request.method, ruta=ruta, estado=str(response.status_code))
+    METRICAS["consultas_peticion"].observar(g.consultas_sql, ruta=ruta)
+    METRICAS["sql_peticion"].observar(g.tiempo_sql, ruta=ruta)
+    response.headers.add(
+        "Server-Timing",
+        f'db;dur={g.tiempo_sql * 1000:.1f};desc="{g.consultas_sql} consultas", app;dur={duracion * 1000:.1f}',
+    )
+
+    perfil = _detener_perfil()
+    if perfil and duracion >= current_app.config['PERFIL_UMBRAL']:
+        _guardar_perfil(perfil, ruta, duracion)
+    return response
 
-# 3. Configuración de la base de datos PostgreSQL
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL")
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+@bp.teardown_app_request
+def _finalizar_medicion(error=None):
+    # after_request no se ejecuta si la vista lanzó una excepción no controlada.
+    _detener_perfil()
 
-# 4. Configuración de la API de Gemini
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-client = None
-if GEMINI_API_KEY:
-    client = genai.Client(api_key=GEMINI_API_KEY)
+def _guardar_perfil(perfil, ruta, duracion):
+    """Guarda el perfil en formato pstats (se abre con snakeviz o se convierte a flamegraph con flameprof)."""
+    carpeta = current_app.config['PERFIL_CARPETA']
+    os.makedirs(carpeta, exist_ok=True)
+    nombre_ruta = re.sub(r'[^A-Za-z0-9]+', '_', ruta).strip('_') or 'raiz'
+    ruta_archivo = os.path.join(carpeta, f"{datetime.now():%Y%m%d-%H%M%S}_{request.method}_{nombre_ruta}_{int(duracion * 1000)}ms.prof")
+    perfil.dump_stats(ruta_archivo)
+    METRICAS["perfiles"].incrementar()
+    current_app.logger.info(f"Petición lenta ({duracion:.2f}s) {request.method} {request.path}: perfil en {ruta_archivo}")
+
+@bp.route('/metrics')
+def metricas():
+    lineas = []
+    for metrica in METRICAS.values():
+        lineas.extend(metrica.exportar())
+    return Response("\n".join(lineas) + "\n", mimetype="text/plain; version=0.0.4")
 
-db = SQLAlchemy(app)
 
 # --- MODELOS DE LA BASE DE DATOS ---
 
+def _ahora_utc():
+    """Fecha y hora UTC sin zona, como se guardan las marcas de sincronización."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class Clase(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), unique=True, nullable=False)
@@ -60,18 +338,392 @@ class Mantenimiento(db.Model):
     supervisor = db.Column(db.String(100), nullable=True)
     tipo_mantenimiento = db.Column(db.String(50), nullable=False)
     descripcion_activo = db.Column(db.String(200), nullable=False)
-    codigo_mantenimiento = db.Column(db.String(100), nullable=False)
+    codigo_mantenimiento = db.Column(db.String(100), nullable=False, index=True)
     mes_programado = db.Column(db.Integer, nullable=False)
     fecha_realizacion = db.Column(db.Date, nullable=True)
     estado = db.Column(db.String(50), nullable=False, default='Programado')
     clase_id = db.Column(db.Integer, db.ForeignKey('clase.id'), nullable=False)
     evidencias = db.relationship('Evidencia', backref='mantenimiento', lazy=True, cascade="all, delete-orphan")
-    nombre_archivo_reporte = db.Column(db.String(255), nullable=True)
+    nombre_archivo_reporte = db.Column(db.String(255), nullable=True, index=True)
+    # Calculados al generar el reporte para no repetir el trabajo en cada descarga
+    nombre_descarga = db.Column(db.String(255), nullable=True)
+    hash_reporte = db.Column(db.String(64), nullable=True)
+    # Huella de los datos con los que se generó el reporte (ver huella_reporte)
+    huella_reporte = db.Column(db.String(64), nullable=True)
+    # Última modificación (UTC), para la sincronización incremental de la API
+    actualizado_en = db.Column(db.DateTime, nullable=True, default=_ahora_utc, onupdate=_ahora_utc, index=True)
+
+# Índices compuestos que cubren los filtros del listado (mes/área) más el orden
+# de paginación, para que cada página sea una lectura acotada del índice.
+# PostgreSQL necesita NULLS LAST explícito; en SQLite los NULL ya quedan al final
+# con DESC y el índice no admite esa cláusula.
+_ORDEN_LISTADO = (Mantenimiento.fecha_realizacion.desc().nulls_last(), Mantenimiento.id.desc())
+
+def _indice_listado(nombre, *columnas):
+    db.Index(nombre, *columnas, *_ORDEN_LISTADO).ddl_if(dialect='postgresql')
+    db.Index(nombre, *columnas, Mantenimiento.fecha_realizacion.desc(), Mantenimiento.id.desc()).ddl_if(
+        callable_=lambda ddl, target, bind, **kw: bind.dialect.name != 'postgresql'
+    )
+
+_indice_listado('ix_mantenimiento_orden')
+_indice_listado('ix_mantenimiento_mes_orden', Mantenimiento.mes_programado)
+_indice_listado('ix_mantenimiento_area_orden', Mantenimiento.area)
+_indice_listado('ix_mantenimiento_mes_area_orden', Mantenimiento.mes_programado, Mantenimiento.area)
 
 class Evidencia(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    nombre_archivo = db.Column(db.String(255), nullable=False)
-    mantenimiento_id = db.Column(db.Integer, db.ForeignKey('mantenimiento.id'), nullable=False)
+    nombre_archivo = db.Column(db.String(255), nullable=False, index=True)
+    mantenimiento_id = db.Column(db.Integer, db.ForeignKey('mantenimiento.id'), nullable=False, index=True)
+
+class RespuestaIA(db.Model):
+    """Nivel persistente de la caché de respuestas de Gemini."""
+    clave = db.Column(db.String(64), primary_key=True)
+    modelo = db.Column(db.String(100), nullable=False)
+    respuesta = db.Column(db.Text, nullable=False)
+    expira_en = db.Column(db.DateTime, nullable=False, index=True)
+
+class TrabajoReporte(db.Model):
+    """Estado de un trabajo de generación de reporte, compartido por todos los workers."""
+    id = db.Column(db.String(32), primary_key=True)
+    # Sin clave foránea: el trabajo puede sobrevivir al mantenimiento hasta que se purga.
+    mantenimiento_id = db.Column(db.Integer, nullable=False, index=True)
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')
+    filename = db.Column(db.String(255), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    creado_en = db.Column(db.DateTime, nullable=False, default=_ahora_utc)
+    terminado_en = db.Column(db.DateTime, nullable=True, index=True)
+
+class MantenimientoEliminado(db.Model):
+    """Registro de mantenimientos borrados, para que la sincronización incremental los informe."""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    eliminado_en = db.Column(db.DateTime, nullable=False, default=_ahora_utc, index=True)
+
+class ResumenMantenimiento(db.Model):
+    """Conteo de mantenimientos por mes, área, clase y estado para el panel de cumplimiento.
+
+    Se mantiene al día en la misma transacción que modifica los mantenimientos
+    (ver ajustar_resumen); el comando reconstruir-resumen lo recalcula completo.
+    """
+    mes_programado = db.Column(db.Integer, primary_key=True)
+    area = db.Column(db.String(50), primary_key=True)
+    clase_id = db.Column(db.Integer, db.ForeignKey('clase.id'), primary_key=True)
+    estado = db.Column(db.String(50), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+
+# --- BÚSQUEDA DE TEXTO COMPLETO ---
+# PostgreSQL: columna generada 'busqueda' (tsvector en español) con índice GIN,
+# que el propio motor mantiene al día. SQLite: tabla virtual FTS5 de contenido
+# externo sincronizada por triggers. Ninguna de las dos está en el modelo porque
+# su tipo no existe en el otro motor; se crean con DDL al crear la tabla o con init-db.
+
+CAMPOS_BUSQUEDA = ('descripcion_activo', 'locacion', 'detalle_mantenimiento_usuario',
+                   'detalle_mantenimiento_sistema', 'informacion_estructurada')
+# Delimitadores del resaltado: se sustituyen por <mark> después de escapar el HTML.
+INICIO_RESALTADO, FIN_RESALTADO = '[[[', ']]]'
+
+_PESOS_BUSQUEDA = {'descripcion_activo': 'A', 'locacion': 'A', 'detalle_mantenimiento_usuario': 'B',
+                   'detalle_mantenimiento_sistema': 'B', 'informacion_estructurada': 'C'}
+DDL_BUSQUEDA = {
+    'postgresql': [
+        "ALTER TABLE mantenimiento ADD COLUMN IF NOT EXISTS busqueda tsvector GENERATED ALWAYS AS ("
+        + " || ".join(f"setweight(to_tsvector('spanish'::regconfig, coalesce({campo}, '')), '{peso}')"
+                      for campo, peso in _PESOS_BUSQUEDA.items())
+        + ") STORED",
+        "CREATE INDEX IF NOT EXISTS ix_mantenimiento_busqueda ON mantenimiento USING GIN (busqueda)",
+    ],
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS mantenimiento_fts USING fts5({', '.join(CAMPOS_BUSQUEDA)}, "
+        "content='mantenimiento', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS mantenimiento_fts_ai AFTER INSERT ON mantenimiento BEGIN "
+        f"INSERT INTO mantenimiento_fts(rowid, {', '.join(CAMPOS_BUSQUEDA)}) "
+        f"VALUES (new.id, {', '.join('new.' + c for c in CAMPOS_BUSQUEDA)}); END",
+        f"CREATE TRIGGER IF NOT EXISTS mantenimiento_fts_ad AFTER DELETE ON mantenimiento BEGIN "
+        f"INSERT INTO mantenimiento_fts(mantenimiento_fts, rowid, {', '.join(CAMPOS_BUSQUEDA)}) "
+        f"VALUES ('delete', old.id, {', '.join('old.' + c for c in CAMPOS_BUSQUEDA)}); END",
+        f"CREATE TRIGGER IF NOT EXISTS mantenimiento_fts_au AFTER UPDATE ON mantenimiento BEGIN "
+        f"INSERT INTO mantenimiento_fts(mantenimiento_fts, rowid, {', '.join(CAMPOS_BUSQUEDA)}) "
+        f"VALUES ('delete', old.id, {', '.join('old.' + c for c in CAMPOS_BUSQUEDA)}); "
+        f"INSERT INTO mantenimiento_fts(rowid, {', '.join(CAMPOS_BUSQUEDA)}) "
+        f"VALUES (new.id, {', '.join('new.' + c for c in CAMPOS_BUSQUEDA)}); END",
+    ],
+}
+for _dialecto, _sentencias in DDL_BUSQUEDA.items():
+    for _sentencia in _sentencias:
+        db.event.listen(Mantenimiento.__table__, 'after_create', db.DDL(_sentencia).execute_if(dialect=_dialecto))
+
+def _asegurar_busqueda():
+    """Crea la estructura de búsqueda en una tabla ya existente y, en SQLite, indexa las filas previas."""
+    dialecto = db.engine.dialect.name
+    with db.engine.begin() as conexion:
+        nueva_fts = dialecto == 'sqlite' and not db.inspect(conexion).has_table('mantenimiento_fts')
+        for sentencia in DDL_BUSQUEDA.get(dialecto, []):
+            conexion.exec_driver_sql(sentencia)
+        if nueva_fts:
+            conexion.exec_driver_sql("INSERT INTO mantenimiento_fts(mantenimiento_fts) VALUES ('rebuild')")
+
+def buscar_mantenimientos(query, texto):
+    """Restringe la consulta a las coincidencias de texto y la ordena por relevancia.
+
+    Devuelve filas (Mantenimiento, fragmento) donde el fragmento trae las
+    coincidencias entre INICIO_RESALTADO y FIN_RESALTADO.
+    """
+    dialecto = db.engine.dialect.name
+    if dialecto == 'postgresql':
+        consulta_ts = db.func.websearch_to_tsquery('spanish', texto)
+        columna = db.literal_column('mantenimiento.busqueda')
+        fragmento = db.func.ts_headline(
+            'spanish',
+            db.func.concat_ws(' … ', *(getattr(Mantenimiento, c) for c in CAMPOS_BUSQUEDA[:4])),
+            consulta_ts,
+            f'StartSel="{INICIO_RESALTADO}", StopSel="{FIN_RESALTADO}", MaxFragments=2, MaxWords=20, MinWords=5',
+        )
+        return (query.filter(columna.op('@@')(consulta_ts))
+                .add_columns(fragmento)
+                .order_by(None)
+                .order_by(db.func.ts_rank_cd(columna, consulta_ts).desc(), Mantenimiento.id.desc()))
+    if dialecto == 'sqlite':
+        # Cada palabra entre comillas: FTS5 las combina con AND y no interpreta su sintaxis.
+        terminos = " ".join('"' + t.replace('"', '""') + '"' for t in texto.split())
+        fragmento = db.literal_column(
+            f"snippet(mantenimiento_fts, -1, '{INICIO_RESALTADO}', '{FIN_RESALTADO}', '…', 16)"
+        )
+        return (query.join(db.table('mantenimiento_fts'), db.text('mantenimiento_fts.rowid = mantenimiento.id'))
+                .filter(db.text('mantenimiento_fts MATCH :terminos').bindparams(terminos=terminos))
+                .add_columns(fragmento)
+                .order_by(None)
+                .order_by(db.literal_column('bm25(mantenimiento_fts)'), Mantenimiento.id.desc()))
+    # Otros motores: coincidencia simple sin ranking ni fragmentos.
+    patron = f"%{texto}%"
+    return query.filter(db.or_(*(getattr(Mantenimiento, c).ilike(patron) for c in CAMPOS_BUSQUEDA))).add_columns(db.null())
+
+def resaltar_fragmento(fragmento):
+    """Escapa el fragmento y convierte los delimitadores de coincidencia en <mark>."""
+    if not fragmento:
+        return None
+    return Markup(str(escape(fragmento)).replace(INICIO_RESALTADO, '<mark>').replace(FIN_RESALTADO, '</mark>'))
+
+
+# --- ALMACENAMIENTO DE EVIDENCIAS DIRECCIONADO POR CONTENIDO ---
+# Cada archivo se guarda como '<sha256><ext>' en UPLOAD_FOLDER. Una misma foto
+# adjuntada a varios mantenimientos ocupa un solo archivo; las filas de
+# Evidencia que apuntan a él son sus referencias y el archivo solo se borra
+# cuando ya no queda ninguna. Las variantes se nombran solo con el hash, así
+# que se conservan mientras algún blob con ese hash siga referenciado.
+
+TAM_LOTE_LIMPIEZA = 1000
+TAM_BLOQUE_SUBIDA = 64 * 1024
+_PATRON_NOMBRE_CONTENIDO = re.compile(r'^[0-9a-f]{64}(\.[a-z0-9]+)?$')
+# Los mismos bytes subidos como .jpeg y .jpg deben dar un solo blob.
+_EXTENSIONES_EQUIVALENTES = {'.jpeg': '.jpg', '.jpe': '.jpg', '.tif': '.tiff'}
+_bloqueo_blobs_hilos = threading.Lock()
+
+def _extension_blob(nombre_archivo):
+    ext = os.path.splitext(nombre_archivo)[1].lower()
+    return _EXTENSIONES_EQUIVALENTES.get(ext, ext)
+
+@contextmanager
+def _bloqueo_blobs():
+    """Serializa la reutilización y el borrado de blobs entre hilos y, con fcntl, entre workers."""
+    ruta = os.path.join(current_app.config['UPLOAD_FOLDER'], '.bloqueo')
+    with _bloqueo_blobs_hilos, open(ruta, 'a') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+def _hash_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        while bloque := f.read(TAM_BLOQUE_SUBIDA):
+            h.update(bloque)
+    return h.hexdigest()
+
+def guardar_evidencia_subida(archivo):
+    """Guarda un archivo subido calculando su hash mientras se escribe. Devuelve el nombre del blob."""
+    ext = _extension_blob(secure_filename(archivo.filename))
+    carpeta = current_app.config['UPLOAD_FOLDER']
+    h = hashlib.sha256()
+    inicio, tamano = time.perf_counter(), 0
+    with tempfile.NamedTemporaryFile(dir=carpeta, prefix='.subida-', delete=False) as temporal:
+        try:
+            while bloque := archivo.stream.read(TAM_BLOQUE_SUBIDA):
+                h.update(bloque)
+                temporal.write(bloque)
+                tamano += len(bloque)
+        except BaseException:
+            temporal.close()
+            os.remove(temporal.name)
+            raise
+
+    nombre = f"{h.hexdigest()}{ext}"
+    ruta = os.path.join(carpeta, nombre)
+    with _bloqueo_blobs():
+        existe = os.path.exists(ruta)
+        if existe:
+            # Se renueva la fecha para que la limpieza no borre un blob que está por referenciarse.
+            os.utime(ruta)
+        else:
+            os.replace(temporal.name, ruta)
+    if existe:
+        os.remove(temporal.name)
+        if archivo_evidencia(nombre, 'mini') == nombre:
+            generar_variantes_evidencia(nombre)
+    else:
+        generar_variantes_evidencia(nombre)
+    METRICAS["subida_bytes"].observar(tamano)
+    METRICAS["subida"].observar(time.perf_counter() - inicio)
+    return nombre
+
+def liberar_evidencias(nombres):
+    """Borra los archivos (y sus variantes) que ya no tienen ninguna Evidencia que los referencie.
+
+    Debe llamarse después del commit que eliminó las referencias. Las referencias
+    se comprueban bajo el bloqueo de blobs justo antes de borrar, y los blobs
+    reutilizados hace menos de EVIDENCIA_GRACIA_LIMPIEZA segundos se dejan para
+    limpiar-archivos: su nueva Evidencia puede estar aún sin confirmar.
+    """
+    carpeta = current_app.config['UPLOAD_FOLDER']
+    nombres = list(set(nombres))
+    for inicio in range(0, len(nombres), TAM_LOTE_LIMPIEZA):
+        lote = nombres[inicio:inicio + TAM_LOTE_LIMPIEZA]
+        with _bloqueo_blobs():
+            limite = time.time() - current_app.config['EVIDENCIA_GRACIA_LIMPIEZA']
+            referenciados = {n for (n,) in db.session.query(Evidencia.nombre_archivo)
+                             .filter(Evidencia.nombre_archivo.in_(lote)).distinct()}
+            libres = [n for n in set(lote) - referenciados if not _modificado_despues(os.path.join(carpeta, n), limite)]
+            bases = {os.path.splitext(n)[0] for n in libres}
+            # Otro blob con el mismo hash (otra extensión) sigue usando las variantes.
+            bases_en_uso = {os.path.splitext(n)[0] for (n,) in db.session.query(Evidencia.nombre_archivo)
+                            .filter(db.func.substr(Evidencia.nombre_archivo, 1, 64).in_(
+                                [b for b in bases if len(b) == 64])).distinct()}
+            for nombre in libres:
+                _eliminar_archivo(carpeta, nombre)
+                if os.path.splitext(nombre)[0] not in bases_en_uso:
+                    eliminar_variantes_evidencia(nombre)
+
+def _modificado_despues(ruta, limite):
+    try:
+        return os.stat(ruta).st_mtime >= limite
+    except FileNotFoundError:
+        return False
+
+def liberar_reportes(nombres):
+    """Borra los reportes Word que ya no pertenecen a ningún mantenimiento (después del commit)."""
+    nombres = list(set(nombres))
+    for inicio in range(0, len(nombres), TAM_LOTE_LIMPIEZA):
+        lote = nombres[inicio:inicio + TAM_LOTE_LIMPIEZA]
+        referenciados = {n for (n,) in db.session.query(Mantenimiento.nombre_archivo_reporte)
+                         .filter(Mantenimiento.nombre_archivo_reporte.in_(lote))}
+        for nombre in set(lote) - referenciados:
+            _eliminar_archivo(current_app.config['GENERATED_REPORTS_FOLDER'], nombre)
+
+def _eliminar_archivo(carpeta, nombre):
+    try:
+        os.remove(os.path.join(carpeta, nombre))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        current_app.logger.warning(f"Error eliminando archivo {nombre}: {e}")
+
+
+class LimpiadorArchivos:
+    """Borra en un hilo aparte los archivos que dejaron de estar referenciados.
+
+    Se encola después del commit, así que la base de datos nunca apunta a un
+    archivo borrado. Si el proceso termina con trabajo pendiente, los archivos
+    quedan huérfanos hasta la próxima ejecución de limpiar-archivos.
+    """
+
+    def __init__(self):
+        self._cola = queue.Queue()
+        self._lock = threading.Lock()
+        self._hilo = None
+
+    def encolar(self, evidencias=(), reportes=()):
+        evidencias, reportes = list(evidencias), list(reportes)
+        if not evidencias and not reportes:
+            return
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._trabajar, name="limpiador-archivos", daemon=True)
+                self._hilo.start()
+        self._cola.put((current_app._get_current_object(), evidencias, reportes))
+
+    def _trabajar(self):
+        while True:
+            app, evidencias, reportes = self._cola.get()
+            try:
+                with app.app_context():
+                    liberar_evidencias(evidencias)
+                    liberar_reportes(reportes)
+            except Exception as e:
+                app.logger.error(f"Error limpiando archivos en segundo plano: {e}")
+            finally:
+                self._cola.task_done()
+
+    def esperar(self):
+        """Bloquea hasta que no quede nada pendiente (útil en comandos CLI)."""
+        self._cola.join()
+
+
+limpiador_archivos = LimpiadorArchivos()
+
+
+# --- PROCESAMIENTO DE IMÁGENES DE EVIDENCIA ---
+# Junto a cada imagen original se guardan dos variantes JPEG normalizadas
+# (orientación EXIF aplicada): '<nombre>_reporte.jpg' para incrustar en los
+# reportes Word y '<nombre>_mini.jpg' para mostrar en la web.
+
+VARIANTES_EVIDENCIA = {
+    'reporte': 'EVIDENCIA_LADO_REPORTE',
+    'mini': 'EVIDENCIA_LADO_MINIATURA',
+}
+
+def nombre_variante(nombre_archivo, variante):
+    base, _ = os.path.splitext(nombre_archivo)
+    return f"{base}_{variante}.jpg"
+
+def generar_variantes_evidencia(nombre_archivo):
+    """Crea las variantes de una evidencia ya guardada. Devuelve False si no es una imagen."""
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    ruta_original = os.path.join(current_app.config['UPLOAD_FOLDER'], nombre_archivo)
+    try:
+        with Image.open(ruta_original) as original:
+            imagen = ImageOps.exif_transpose(original)
+            if imagen.mode != 'RGB':
+                imagen = imagen.convert('RGB')
+            for variante, clave_lado in VARIANTES_EVIDENCIA.items():
+                lado = current_app.config[clave_lado]
+                copia = imagen.copy()
+                copia.thumbnail((lado, lado), Image.Resampling.LANCZOS)
+                copia.save(
+                    os.path.join(current_app.config['UPLOAD_FOLDER'], nombre_variante(nombre_archivo, variante)),
+                    'JPEG', quality=current_app.config['EVIDENCIA_CALIDAD_JPEG'], optimize=True, progressive=True
+                )
+        return True
+    except (UnidentifiedImageError, OSError) as e:
+        current_app.logger.warning(f"No se generaron variantes para la evidencia {nombre_archivo}: {e}")
+        return False
+
+def archivo_evidencia(nombre_archivo, variante=None):
+    """Nombre del archivo a usar para una evidencia: la variante si existe, si no el original."""
+    if variante:
+        nombre = nombre_variante(nombre_archivo, variante)
+        if os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], nombre)):
+            return nombre
+    return nombre_archivo
+
+def eliminar_variantes_evidencia(nombre_archivo):
+    for variante in VARIANTES_EVIDENCIA:
+        try:
+            os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], nombre_variante(nombre_archivo, variante)))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            current_app.logger.warning(f"Error eliminando variante {variante} de {nombre_archivo}: {e}")
+
+bp.add_app_template_global(archivo_evidencia)
 
 
 # --- RUTAS DE LA APLICACIÓN ---
@@ -79,39 +731,111 @@ class Evidencia(db.Model):
 MESES = {1: "Enero", 2: "Febrero", 3: "Marzo", 4: "Abril", 5: "Mayo", 6: "Junio", 7: "Julio", 8: "Agosto", 9: "Septiembre", 10: "Octubre", 11: "Noviembre", 12: "Diciembre"}
 AREAS = ["Mecánica", "Gasfitería", "Instrumentación"]
 
-@app.route('/')
+POR_PAGINA = 50
+
+def _codificar_cursor(mant):
+    """Cursor de paginación por conjunto de claves: 'AAAA-MM-DD.id' o '~.id' si no hay fecha."""
+    fecha = mant.fecha_realizacion.isoformat() if mant.fecha_realizacion else '~'
+    return f"{fecha}.{mant.id}"
+
+def _decodificar_cursor(cursor):
+    """Devuelve (fecha, id) a partir del cursor, o None si no es válido."""
+    try:
+        fecha_str, id_str = cursor.rsplit('.', 1)
+        fecha = None if fecha_str == '~' else date.fromisoformat(fecha_str)
+        return fecha, int(id_str)
+    except (AttributeError, ValueError):
+        return None
+
+def _pagina_despues_de(query, cursor, limite):
+    """Hasta `limite` filas posteriores al cursor en el orden fecha DESC NULLS LAST, id DESC.
+
+    Cada tramo usa una condición que el índice resuelve como búsqueda por rango:
+    primero (fecha, id) < cursor entre las filas con fecha (la comparación de
+    filas descarta los NULL) y, si no alcanza, la cola de filas sin fecha.
+    Un OR entre ambos tramos obligaría a recorrer el índice desde el principio.
+    """
+    fecha, ultimo_id = cursor
+    filas = []
+    if fecha is None:
+        condicion_sin_fecha = db.and_(Mantenimiento.fecha_realizacion.is_(None), Mantenimiento.id < ultimo_id)
+    else:
+        filas = query.filter(
+            db.tuple_(Mantenimiento.fecha_realizacion, Mantenimiento.id) < db.tuple_(fecha, ultimo_id)
+        ).limit(limite).all()
+        if len(filas) == limite:
+            return filas
+        condicion_sin_fecha = Mantenimiento.fecha_realizacion.is_(None)
+    return filas + query.filter(condicion_sin_fecha).limit(limite - len(filas)).all()
+
+def consulta_mantenimientos(mes=None, area=None):
+    """Consulta del listado con los filtros de index(), en el orden de paginación."""
+    query = Mantenimiento.query.order_by(*_ORDEN_LISTADO)
+    if mes:
+        query = query.filter(Mantenimiento.mes_programado == mes)
+    if area:
+        query = query.filter(Mantenimiento.area == area)
+    return query
+
+@bp.route('/')
 def index():
     mes_filtrado = request.args.get('mes', type=int)
     area_filtrada = request.args.get('area', type=str)
-    query = Mantenimiento.query.order_by(Mantenimiento.fecha_realizacion.desc().nulls_last(), Mantenimiento.id.desc())
-    if mes_filtrado:
-        query = query.filter(Mantenimiento.mes_programado == mes_filtrado)
-    if area_filtrada:
-        query = query.filter(Mantenimiento.area == area_filtrada)
-    
-    lista_mantenimientos = query.all()
+    texto_busqueda = request.args.get('q', '', type=str).strip()
+    query = consulta_mantenimientos(mes_filtrado, area_filtrada).options(db.joinedload(Mantenimiento.clase))
+    filtros = dict(mes=mes_filtrado, area=area_filtrada, q=texto_busqueda or None)
+    fragmentos = {}
+    siguiente_url = None
+
+    if texto_busqueda:
+        # Con búsqueda el orden es por relevancia, así que se pagina por número de página.
+        pagina = max(request.args.get('pagina', 1, type=int), 1)
+        filas = buscar_mantenimientos(query, texto_busqueda).offset((pagina - 1) * POR_PAGINA).limit(POR_PAGINA + 1).all()
+        if len(filas) > POR_PAGINA:
+            filas = filas[:POR_PAGINA]
+            siguiente_url = url_for('principal.index', **filtros, pagina=pagina + 1)
+        lista_mantenimientos = [mant for mant, _ in filas]
+        fragmentos = {mant.id: resaltar_fragmento(fragmento) for mant, fragmento in filas}
+        es_primera_pagina = pagina == 1
+    else:
+        cursor = _decodificar_cursor(request.args.get('despues'))
+
+        # Pedimos una fila extra solo para saber si existe una página siguiente.
+        if cursor:
+            lista_mantenimientos = _pagina_despues_de(query, cursor, POR_PAGINA + 1)
+        else:
+            lista_mantenimientos = query.limit(POR_PAGINA + 1).all()
+        if len(lista_mantenimientos) > POR_PAGINA:
+            lista_mantenimientos = lista_mantenimientos[:POR_PAGINA]
+            siguiente_url = url_for('principal.index', **filtros, despues=_codificar_cursor(lista_mantenimientos[-1]))
+        es_primera_pagina = cursor is None
+
     return render_template(
         "index.html", 
         mantenimientos=lista_mantenimientos, 
         meses=MESES, 
         mes_seleccionado=mes_filtrado,
         areas=AREAS,
-        area_seleccionada=area_filtrada
+        area_seleccionada=area_filtrada,
+        texto_busqueda=texto_busqueda,
+        fragmentos=fragmentos,
+        siguiente_url=siguiente_url,
+        primera_url=None if es_primera_pagina else url_for('principal.index', **filtros)
     )
 
 # ... (Las rutas /nuevo, /mantenimiento/<id> no cambian) ...
-@app.route('/nuevo')
+@bp.route('/nuevo')
 def nuevo_reporte():
     clases = Clase.query.order_by(Clase.nombre).all()
     return render_template("nuevo_reporte.html", meses=MESES, clases=clases)
 
-@app.route('/mantenimiento/<int:id>')
+@bp.route('/mantenimiento/<int:id>')
 def mantenimiento_detalle(id):
     mantenimiento = Mantenimiento.query.get_or_404(id)
     clases = Clase.query.order_by(Clase.nombre).all()
     return render_template("mantenimiento_detalle.html", mantenimiento=mantenimiento, meses=MESES, clases=clases)
 
-@app.route('/guardar', methods=['POST'])
+@bp.route('/guardar', methods=['POST'])
 def guardar():
     mantenimiento_id = request.form.get('id')
     
@@ -131,9 +855,11 @@ def guardar():
     fecha_realizacion = db.func.to_date(fecha_str, 'YYYY-MM-DD') if fecha_str else None
     estado = request.form.get('estado')
 
+    cambios_resumen = Counter()
     if mantenimiento_id:
         mant = Mantenimiento.query.get(mantenimiento_id)
         if not mant: return "Mantenimiento no encontrado", 404
+        cambios_resumen[clave_resumen(mant)] -= 1
         mant.area = area
         mant.clase_id = clase_id
         mant.tipo_mantenimiento = tipo_mantenimiento
@@ -162,86 +888,720 @@ def guardar():
         db.session.flush()
         mant = nuevo_mant
         flash(f"Nuevo mantenimiento #{mant.id} creado con éxito.", "success")
+    cambios_resumen[clave_resumen(mant)] += 1
+    ajustar_resumen(cambios_resumen)
 
     evidencias = request.files.getlist("evidencias")
+    ya_adjuntas = {e.nombre_archivo for e in mant.evidencias} if mantenimiento_id else set()
     for img in evidencias:
         if img.filename:
-            original_filename = secure_filename(img.filename)
-            _, ext = os.path.splitext(original_filename)
-            unique_prefix = uuid.uuid4().hex
-            nuevo_nombre_archivo = f"{unique_prefix}{ext.lower()}"
-            img.save(os.path.join(app.config['UPLOAD_FOLDER'], nuevo_nombre_archivo))
+            nuevo_nombre_archivo = guardar_evidencia_subida(img)
+            # La misma foto adjuntada dos veces al mismo mantenimiento se registra una sola vez.
+            if nuevo_nombre_archivo in ya_adjuntas:
+                continue
+            ya_adjuntas.add(nuevo_nombre_archivo)
             nueva_evidencia = Evidencia(nombre_archivo=nuevo_nombre_archivo, mantenimiento_id=mant.id)
             db.session.add(nueva_evidencia)
+            mant.actualizado_en = _ahora_utc()
 
     db.session.commit()
-    return redirect(url_for('mantenimiento_detalle', id=mant.id))
+    return redirect(url_for('principal.mantenimiento_detalle', id=mant.id))
 
-# ... (Las rutas de eliminación no cambian) ...
-@app.route('/mantenimiento/eliminar/<int:id>', methods=['POST'])
-def eliminar_mantenimiento(id):
-    mant = Mantenimiento.query.get_or_404(id)
-    for evidencia in mant.evidencias:
-        try:
-            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], evidencia.nombre_archivo))
-        except OSError as e:
-            print(f"Error eliminando archivo {evidencia.nombre_archivo}: {e}")
-            
-    db.session.delete(mant)
+def eliminar_mantenimientos(ids):
+    """Elimina en una transacción los mantenimientos indicados con DELETE por conjuntos.
+
+    Actualiza el resumen del panel, registra las bajas para la sincronización y,
+    tras el commit, encola el borrado de evidencias y reportes que queden sin
+    uso. Devuelve cuántos mantenimientos se eliminaron.
+    """
+    ids = sorted(set(ids))
+    conexion = db.session.connection()
+    mantenimientos, evidencias = Mantenimiento.__table__, Evidencia.__table__
+    eliminados, nombres_evidencias, nombres_reportes = 0, set(), set()
+    ahora = _ahora_utc()
+    for inicio in range(0, len(ids), TAM_LOTE_LIMPIEZA):
+        lote = ids[inicio:inicio + TAM_LOTE_LIMPIEZA]
+        columnas = (mantenimientos.c.mes_programado, mantenimientos.c.area, mantenimientos.c.clase_id, mantenimientos.c.estado)
+        ajustar_resumen({tuple(fila[:4]): -fila[4] for fila in conexion.execute(
+            db.select(*columnas, db.func.count()).where(mantenimientos.c.id.in_(lote)).group_by(*columnas))})
+        nombres_evidencias.update(n for (n,) in conexion.execute(
+            db.select(evidencias.c.nombre_archivo).where(evidencias.c.mantenimiento_id.in_(lote)).distinct()))
+        nombres_reportes.update(n for (n,) in conexion.execute(
+            db.select(mantenimientos.c.nombre_archivo_reporte)
+            .where(mantenimientos.c.id.in_(lote), mantenimientos.c.nombre_archivo_reporte.isnot(None))))
+
+        bajas = MantenimientoEliminado.__table__
+        existentes = db.select(mantenimientos.c.id).where(mantenimientos.c.id.in_(lote))
+        conexion.execute(bajas.delete().where(bajas.c.id.in_(existentes)))
+        conexion.execute(bajas.insert().from_select(
+            ['id', 'eliminado_en'],
+            db.select(mantenimientos.c.id, db.literal(ahora, db.DateTime)).where(mantenimientos.c.id.in_(lote)),
+        ))
+        conexion.execute(evidencias.delete().where(evidencias.c.mantenimiento_id.in_(lote)))
+        eliminados += conexion.execute(mantenimientos.delete().where(mantenimientos.c.id.in_(lote))).rowcount
     db.session.commit()
+    # Las instancias que la sesión tuviera cargadas ya no existen en la base de datos.
+    db.session.expunge_all()
+    limpiador_archivos.encolar(nombres_evidencias, nombres_reportes)
+    return eliminados
+
+@bp.route('/mantenimiento/eliminar/<int:id>', methods=['POST'])
+def eliminar_mantenimiento(id):
+    if not eliminar_mantenimientos([id]):
+        abort(404)
     flash(f"Mantenimiento #{id} y sus evidencias han sido eliminados.", "success")
-    return redirect(url_for('index'))
+    return redirect(url_for('principal.index'))
+
+@bp.route('/mantenimientos/eliminar', methods=['POST'])
+def eliminar_mantenimientos_en_bloque():
+    """Elimina los mantenimientos marcados (campo 'ids') o, con todo_el_filtro=1, todos los que cumplen mes/área."""
+    ids = request.form.getlist('ids', type=int)
+    mes = request.form.get('mes', type=int)
+    area = request.form.get('area') or None
+    filtros = dict(mes=mes, area=area)
+    if request.form.get('todo_el_filtro') == '1':
+        if ids or (not mes and not area):
+            flash("Aplica un filtro de mes o área antes de eliminar todo el filtro.", "warning")
+            return redirect(url_for('principal.index', **filtros))
+        ids = [id for (id,) in consulta_mantenimientos(mes, area).order_by(None).with_entities(Mantenimiento.id)]
+    elif not ids:
+        flash("Selecciona al menos un mantenimiento para eliminar.", "warning")
+        return redirect(url_for('principal.index', **filtros))
+    eliminados = eliminar_mantenimientos(ids)
+    flash(f"Se eliminaron {eliminados} mantenimientos y sus evidencias.", "success")
+    return redirect(url_for('principal.index', **filtros))
 
-@app.route('/evidencia/eliminar/<int:id>', methods=['POST'])
+@bp.route('/evidencia/eliminar/<int:id>', methods=['POST'])
 def eliminar_evidencia(id):
     evidencia = Evidencia.query.get_or_404(id)
-    
-    try:
-        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], evidencia.nombre_archivo))
-    except OSError as e:
-        flash(f"Error al eliminar el archivo físico: {e}", "danger")
-        return {"error": str(e)}, 500
+    nombre = evidencia.nombre_archivo
 
+    evidencia.mantenimiento.actualizado_en = _ahora_utc()
     db.session.delete(evidencia)
     db.session.commit()
+    limpiador_archivos.encolar(evidencias=[nombre])
     flash("Evidencia eliminada correctamente.", "success")
     return {"success": True}
 
-@app.route('/uploads/<filename>')
+def servir_archivo(carpeta, nombre, ubicacion_interna, etag=True, inmutable=False, **opciones):
+    """Sirve un archivo con ETag, respuestas 304 y peticiones Range.
+
+    Si X_ACCEL_PREFIJO está configurado, la respuesta no lleva el contenido sino
+    una cabecera X-Accel-Redirect hacia '<prefijo>/<ubicacion_interna>/<nombre>'
+    para que nginx entregue los bytes; con USE_X_SENDFILE se usa X-Sendfile.
+    """
+    prefijo = current_app.config['X_ACCEL_PREFIJO']
+    delegar = bool(prefijo) or current_app.config['USE_X_SENDFILE']
+    respuesta = werkzeug_send_from_directory(
+        os.path.join(current_app.root_path, carpeta), nombre, request.environ,
+        etag=etag,
+        max_age=31536000 if inmutable else 0,
+        use_x_sendfile=delegar,
+        # Al delegar, los rangos los resuelve el servidor web; aquí solo respondemos 304.
+        conditional=not delegar,
+        response_class=current_app.response_class,
+        **opciones,
+    )
+    if delegar:
+        respuesta = respuesta.make_conditional(request.environ)
+    if inmutable:
+        respuesta.cache_control.immutable = True
+    else:
+        # Siempre revalidar: el archivo puede regenerarse con el mismo nombre.
+        respuesta.cache_control.no_cache = True
+    if prefijo and respuesta.headers.pop('X-Sendfile', None):
+        respuesta.headers['X-Accel-Redirect'] = f"{prefijo.rstrip('/')}/{ubicacion_interna}/{quote(nombre)}"
+    return respuesta
+
+@bp.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # Los archivos direccionados por contenido (y sus variantes) nunca cambian.
+    base = os.path.splitext(filename)[0]
+    hash_contenido = base.split('_', 1)[0]
+    if _PATRON_NOMBRE_CONTENIDO.match(hash_contenido):
+        return servir_archivo(current_app.config['UPLOAD_FOLDER'], filename, 'uploads', etag=base, inmutable=True)
+    return servir_archivo(current_app.config['UPLOAD_FOLDER'], filename, 'uploads')
 
 # --- RUTAS PARA LA INTEGRACIÓN CON IA ---
 
-def call_gemini_api(prompt):
-    """Función helper para llamar a la API de Gemini usando el objeto Client."""
-    if not client:
-        raise Exception("El cliente de la API de Gemini no está configurado. Revisa tu GEMINI_API_KEY.")
-    
-    model_name = "gemini-2.5-flash-lite"
-    
-    contents = [
-        types.Content(
-            role="user",
-            parts=[types.Part.from_text(text=prompt)],
+class CacheRespuestasIA:
+    """Caché de dos niveles para las respuestas de Gemini.
+
+    La clave es el hash del nombre del modelo más el prompt normalizado. Un
+    LRU en memoria atiende los aciertos más frecuentes y la tabla RespuestaIA
+    comparte las respuestas entre procesos y reinicios. Las peticiones
+    idénticas que llegan mientras otra está en vuelo esperan su resultado en
+    lugar de hacer una segunda llamada.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._memoria = OrderedDict()
+        self._en_vuelo = {}
+        self.contadores = {"hits_memoria": 0, "hits_persistente": 0, "misses": 0, "coalescidas": 0}
+
+    @staticmethod
+    def clave(modelo, prompt):
+        normalizado = "\n".join(" ".join(linea.split()) for linea in prompt.strip().splitlines())
+        return hashlib.sha256(f"{modelo}\n{normalizado}".encode("utf-8")).hexdigest()
+
+    def _contar(self, contador):
+        with self._lock:
+            self.contadores[contador] += 1
+
+    def _leer_memoria(self, clave):
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if not entrada:
+                return None
+            respuesta, expira_en = entrada
+            if expira_en < time.time():
+                del self._memoria[clave]
+                return None
+            self._memoria.move_to_end(clave)
+            return respuesta
+
+    def _guardar_memoria(self, clave, respuesta, expira_en):
+        with self._lock:
+            self._memoria[clave] = (respuesta, expira_en)
+            self._memoria.move_to_end(clave)
+            while len(self._memoria) > current_app.config['IA_CACHE_MAX_MEMORIA']:
+                self._memoria.popitem(last=False)
+
+    def _leer_persistente(self, clave):
+        try:
+            fila = db.session.get(RespuestaIA, clave)
+            if fila and fila.expira_en > _ahora_utc():
+                return fila.respuesta, fila.expira_en.replace(tzinfo=timezone.utc).timestamp()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning(f"No se pudo leer la caché persistente de IA: {e}")
+        return None
+
+    def _guardar_persistente(self, clave, modelo, respuesta, expira_en):
+        try:
+            ahora = _ahora_utc()
+            RespuestaIA.query.filter(RespuestaIA.expira_en < ahora).delete(synchronize_session=False)
+            db.session.merge(RespuestaIA(clave=clave, modelo=modelo, respuesta=respuesta,
+                                         expira_en=datetime.fromtimestamp(expira_en, timezone.utc).replace(tzinfo=None)))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning(f"No se pudo escribir la caché persistente de IA: {e}")
+
+    def consultar(self, modelo, prompt):
+        """Devuelve la respuesta cacheada (memoria o persistente) o None, sin coalescer."""
+        clave = self.clave(modelo, prompt)
+        respuesta = self._leer_memoria(clave)
+        if respuesta is not None:
+            self._contar("hits_memoria")
+            return respuesta
+        persistida = self._leer_persistente(clave)
+        if persistida:
+            self._contar("hits_persistente")
+            self._guardar_memoria(clave, *persistida)
+            return persistida[0]
+        self._contar("misses")
+        return None
+
+    def almacenar(self, modelo, prompt, respuesta):
+        clave = self.clave(modelo, prompt)
+        expira_en = time.time() + current_app.config['IA_CACHE_TTL']
+        self._guardar_memoria(clave, respuesta, expira_en)
+        self._guardar_persistente(clave, modelo, respuesta, expira_en)
+
+    def unirse(self, modelo, prompt):
+        """Registra la petición como la que calcula la respuesta o la une a la idéntica en vuelo.
+
+        Devuelve (futuro, es_lider). Los seguidores esperan futuro.result(); el
+        líder debe llamar a terminar() pase lo que pase.
+        """
+        clave = self.clave(modelo, prompt)
+        with self._lock:
+            futuro = self._en_vuelo.get(clave)
+            if futuro is not None:
+                self.contadores["coalescidas"] += 1
+                return futuro, False
+            futuro = self._en_vuelo[clave] = Future()
+            return futuro, True
+
+    def terminar(self, modelo, prompt, futuro, respuesta=None, error=None):
+        """Resuelve el futuro del líder y lo quita de las peticiones en vuelo (solo la primera vez cuenta).
+
+        Sin respuesta ni error, la petición se abandonó y los seguidores reciben IANoDisponible.
+        """
+        clave = self.clave(modelo, prompt)
+        with self._lock:
+            if self._en_vuelo.get(clave) is futuro:
+                del self._en_vuelo[clave]
+            if futuro.done():
+                return
+            if respuesta is not None:
+                futuro.set_result(respuesta)
+            else:
+                futuro.set_exception(error or IANoDisponible("La petición idéntica en curso se interrumpió.", reintentar_en=1))
+
+    def obtener(self, modelo, prompt, calcular, es_cacheable=lambda respuesta: True):
+        """Devuelve la respuesta cacheada o ejecuta calcular() una sola vez para todas las peticiones idénticas."""
+        clave = self.clave(modelo, prompt)
+        respuesta = self._leer_memoria(clave)
+        if respuesta is not None:
+            self._contar("hits_memoria")
+            return respuesta
+
+        futuro, es_lider = self.unirse(modelo, prompt)
+        if not es_lider:
+            return futuro.result()
+
+        try:
+            persistida = self._leer_persistente(clave)
+            if persistida:
+                respuesta, expira_en = persistida
+                self._contar("hits_persistente")
+                self._guardar_memoria(clave, respuesta, expira_en)
+            else:
+                self._contar("misses")
+                respuesta = calcular()
+                if es_cacheable(respuesta):
+                    self.almacenar(modelo, prompt, respuesta)
+            self.terminar(modelo, prompt, futuro, respuesta)
+            return respuesta
+        except Exception as e:
+            self.terminar(modelo, prompt, futuro, error=e)
+            raise
+        finally:
+            self.terminar(modelo, prompt, futuro)
+
+    def estadisticas(self):
+        with self._lock:
+            return {**self.contadores, "entradas_memoria": len(self._memoria)}
+
+
+cache_ia = CacheRespuestasIA()
+
+def _es_json_valido(texto):
+    try:
+        json.loads(texto)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+class IANoDisponible(Exception):
+    """La IA no puede atender ahora (cortacircuitos abierto, sin cupo o fallos transitorios agotados)."""
+
+    def __init__(self, mensaje, reintentar_en=None):
+        super().__init__(mensaje)
+        self.reintentar_en = reintentar_en
+
+
+class BackendGemini:
+    """Llamadas reales a la API de Gemini."""
+
+    def __init__(self, api_key, timeout):
+        if not api_key:
+            raise Exception("El cliente de la API de Gemini no está configurado. Revisa tu GEMINI_API_KEY.")
+        from google import genai
+        from google.genai import types
+
+        # El plazo de cada intento lo impone el propio cliente HTTP (en milisegundos).
+        self._cliente = genai.Client(api_key=api_key, http_options=types.HttpOptions(timeout=int(timeout * 1000)))
+
+    @staticmethod
+    def _solicitud(prompt):
+        """Argumentos comunes para generate_content y generate_content_stream."""
+        from google.genai import types
+
+        contents = [
+            types.Content(
+                role="user",
+                parts=[types.Part.from_text(text=prompt)],
+            )
+        ]
+        generation_config_obj = types.GenerateContentConfig(
+            response_mime_type="application/json"
         )
-    ]
-    
-    generation_config_obj = types.GenerateContentConfig(
-        response_mime_type="application/json"
-    )
+        return dict(model=GEMINI_MODEL, contents=contents, config=generation_config_obj)
+
+    def generar(self, prompt):
+        return self._cliente.models.generate_content(**self._solicitud(prompt)).text
+
+    def generar_stream(self, prompt):
+        """Genera los fragmentos de texto de la respuesta a medida que llegan."""
+        for chunk in self._cliente.models.generate_content_stream(**self._solicitud(prompt)):
+            if chunk.text:
+                yield chunk.text
+
+
+class BackendIAFalso:
+    """Backend simulado para pruebas sin conexión.
+
+    Devuelve un JSON válido con las claves que esperan las rutas, tras una
+    latencia configurable, y falla con errores transitorios con la
+    probabilidad indicada (IA_FALSO_LATENCIA, IA_FALSO_TASA_FALLOS).
+    """
+
+    RESPUESTA_ESTRUCTURADA = {
+        "strTituloDocumento": "INFORME de mantenimiento (simulado)",
+        "strTituloMantenimiento": "INFORME DE MANTENIMIENTO SIMULADO",
+        "strActividad": "Mantenimiento simulado.",
+        "strAlcance": "Respuesta generada sin conexión.",
+        "strEstado": "El equipo se encontraba operativo.",
+        "strEstadoEquipo": "Sin observaciones.",
+        "listTrabajosPrevios": ["Coordinar con producción la parada del equipo."],
+        "listActividades": [{"strSubActividad": "ACTIVIDAD SIMULADA.", "listSubActividad": ["Se realizó la inspección."]}],
+        "listConclusiones": ["Respuesta simulada."],
+    }
+
+    def __init__(self, latencia=0.0, tasa_fallos=0.0, respuesta=None):
+        self.latencia = latencia
+        self.tasa_fallos = tasa_fallos
+        self.respuesta = respuesta
+        self.llamadas = 0
+
+    def _texto(self, prompt):
+        if self.respuesta is not None:
+            return self.respuesta
+        if "strResultado" in prompt:
+            return json.dumps({"strResultado": "Se realizó el mantenimiento (respuesta simulada)."}, ensure_ascii=False)
+        return json.dumps(self.RESPUESTA_ESTRUCTURADA, ensure_ascii=False)
+
+    def _simular(self):
+        self.llamadas += 1
+        time.sleep(self.latencia)
+        if random.random() < self.tasa_fallos:
+            raise ConnectionError("Fallo transitorio simulado.")
+
+    def generar(self, prompt):
+        self._simular()
+        return self._texto(prompt)
+
+    def generar_stream(self, prompt):
+        self._simular()
+        texto = self._texto(prompt)
+        for inicio in range(0, len(texto), 40):
+            yield texto[inicio:inicio + 40]
+
+
+class ClienteIA:
+    """Acceso protegido a la IA para que un proveedor lento no bloquee todos los workers.
+
+    - Un semáforo limita las llamadas simultáneas; si no hay cupo en
+      IA_ESPERA_CUPO segundos se responde de inmediato con IANoDisponible.
+    - Cada intento tiene su plazo (IA_TIMEOUT) y la llamada completa, reintentos
+      incluidos, no pasa de IA_PLAZO_TOTAL.
+    - Los errores transitorios (timeouts, conexión, 429 y 5xx) se reintentan
+      con espera exponencial aleatoria ("full jitter").
+    - Tras IA_CIRCUITO_FALLOS fallos seguidos el cortacircuitos se abre y las
+      llamadas fallan sin salir del servidor durante IA_CIRCUITO_ENFRIAMIENTO
+      segundos; después se deja pasar una llamada de prueba.
+    """
+
+    CODIGOS_TRANSITORIOS = {408, 429, 500, 502, 503, 504}
+
+    def __init__(self, backend=None):
+        self._lock = threading.Lock()
+        self._backend = backend
+        self._semaforo = None
+        self._fallos_seguidos = 0
+        self._abierto_hasta = 0.0
+        self._prueba_en_curso = False
+        self.contadores = {"llamadas": 0, "reintentos": 0, "fallos": 0, "rechazadas_circuito": 0, "rechazadas_cupo": 0}
+
+    def backend(self):
+        with self._lock:
+            if self._backend is None:
+                if current_app.config['IA_BACKEND'] == "falso":
+                    self._backend = BackendIAFalso(
+                        latencia=float(os.getenv("IA_FALSO_LATENCIA", 0)),
+                        tasa_fallos=float(os.getenv("IA_FALSO_TASA_FALLOS", 0)),
+                    )
+                else:
+                    self._backend = BackendGemini(current_app.config['GEMINI_API_KEY'], current_app.config['IA_TIMEOUT'])
+            return self._backend
+
+    def usar_backend(self, backend):
+        """Sustituye el backend (p. ej. por un BackendIAFalso) y reinicia el cortacircuitos."""
+        with self._lock:
+            self._backend = backend
+            self._fallos_seguidos = 0
+            self._abierto_hasta = 0.0
+            self._prueba_en_curso = False
+
+    def _cupos(self):
+        with self._lock:
+            if self._semaforo is None:
+                self._semaforo = threading.BoundedSemaphore(current_app.config['IA_MAX_CONCURRENTES'])
+            return self._semaforo
+
+    def _contar(self, contador):
+        with self._lock:
+            self.contadores[contador] += 1
+
+    @classmethod
+    def es_transitorio(cls, error):
+        # Si el SDK de Gemini (y con él httpx) no se ha importado, el error no puede venir de ahí.
+        genai_errors = sys.modules.get("google.genai.errors")
+        if genai_errors and isinstance(error, genai_errors.APIError):
+            return error.code in cls.CODIGOS_TRANSITORIOS
+        httpx = sys.modules.get("httpx")
+        if httpx and isinstance(error, (httpx.TimeoutException, httpx.TransportError)):
+            return True
+        return isinstance(error, (TimeoutError, ConnectionError))
+
+    def _segundos_abierto(self):
+        return max(0.0, self._abierto_hasta - time.monotonic())
+
+    def disponible(self):
+        """False mientras el cortacircuitos esté abierto."""
+        with self._lock:
+            return self._segundos_abierto() == 0 and not self._prueba_en_curso
+
+    def _pedir_paso(self):
+        """Deja pasar la llamada o lanza IANoDisponible si el circuito está abierto."""
+        with self._lock:
+            espera = self._segundos_abierto()
+            if espera == 0 and self._fallos_seguidos >= current_app.config['IA_CIRCUITO_FALLOS']:
+                # Semiabierto: una sola llamada de prueba decide si se cierra.
+                if self._prueba_en_curso:
+                    espera = 1.0
+                else:
+                    self._prueba_en_curso = True
+            if espera:
+                self.contadores["rechazadas_circuito"] += 1
+                raise IANoDisponible("El servicio de IA no está disponible temporalmente.", reintentar_en=int(espera) + 1)
+
+    def _registrar_exito(self):
+        with self._lock:
+            self._fallos_seguidos = 0
+            self._abierto_hasta = 0.0
+            self._prueba_en_curso = False
+
+    def _registrar_fallo(self):
+        with self._lock:
+            self.contadores["fallos"] += 1
+            self._fallos_seguidos += 1
+            self._prueba_en_curso = False
+            if self._fallos_seguidos >= current_app.config['IA_CIRCUITO_FALLOS']:
+                self._abierto_hasta = time.monotonic() + current_app.config['IA_CIRCUITO_ENFRIAMIENTO']
+                current_app.logger.warning(f"Cortacircuitos de IA abierto tras {self._fallos_seguidos} fallos seguidos.")
+
+    def _intentos(self):
+        """Itera los intentos permitidos, esperando con jitter entre uno y otro dentro del plazo total."""
+        limite = time.monotonic() + current_app.config['IA_PLAZO_TOTAL']
+        for intento in range(current_app.config['IA_REINTENTOS'] + 1):
+            if intento:
+                espera = random.uniform(0, current_app.config['IA_ESPERA_BASE'] * 2 ** intento)
+                if time.monotonic() + espera >= limite:
+                    return
+                self._contar("reintentos")
+                time.sleep(espera)
+            yield intento
+
+    def _tomar_cupo(self):
+        """Pasa el cortacircuitos y reserva un cupo de llamada, o lanza IANoDisponible."""
+        self._pedir_paso()
+        if not self._cupos().acquire(timeout=current_app.config['IA_ESPERA_CUPO']):
+            with self._lock:
+                self._prueba_en_curso = False
+                self.contadores["rechazadas_cupo"] += 1
+            raise IANoDisponible("El servicio de IA está saturado.", reintentar_en=int(current_app.config['IA_ESPERA_CUPO']) + 1)
+        self._contar("llamadas")
+
+    def _fallo(self, error):
+        """Registra un error; devuelve True si es transitorio (y por tanto se puede reintentar)."""
+        if not self.es_transitorio(error):
+            self._registrar_exito()  # El proveedor respondió: el error es de la petición.
+            return False
+        self._registrar_fallo()
+        current_app.logger.warning(f"Error transitorio de IA: {error}")
+        return True
+
+    def _agotado(self, error):
+        with self._lock:
+            espera = self._segundos_abierto()
+        return IANoDisponible(f"El servicio de IA no respondió correctamente ({error}).",
+                              reintentar_en=int(espera) + 1 if espera else 5)
 
-    response = client.models.generate_content(
-        model=model_name,
-        contents=contents,
-        config=generation_config_obj
+    def generar(self, prompt):
+        ultimo_error = None
+        for _ in self._intentos():
+            self._tomar_cupo()
+            inicio = time.perf_counter()
+            try:
+                respuesta = self.backend().generar(prompt)
+            except Exception as e:
+                METRICAS["ia"].observar(time.perf_counter() - inicio, modo="completa", resultado="error")
+                if not self._fallo(e):
+                    raise
+                ultimo_error = e
+                continue
+            finally:
+                self._cupos().release()
+            METRICAS["ia"].observar(time.perf_counter() - inicio, modo="completa", resultado="ok")
+            self._registrar_exito()
+            return respuesta
+        raise self._agotado(ultimo_error) from ultimo_error
+
+    def generar_stream(self, prompt):
+        """Como generar(), pero por fragmentos; el cupo se mantiene mientras dure el stream.
+
+        Solo se reintenta si el fallo llega antes del primer fragmento: después
+        el cliente ya recibió parte del texto.
+        """
+        ultimo_error = None
+        for _ in self._intentos():
+            self._tomar_cupo()
+            emitido = registrado = False
+            inicio = time.perf_counter()
+            try:
+                for texto in self.backend().generar_stream(prompt):
+                    emitido = True
+                    yield texto
+            except Exception as e:
+                METRICAS["ia"].observar(time.perf_counter() - inicio, modo="stream", resultado="error")
+                registrado = True
+                if not self._fallo(e):
+                    raise
+                if emitido:
+                    raise self._agotado(e) from e
+                ultimo_error = e
+                continue
+            else:
+                METRICAS["ia"].observar(time.perf_counter() - inicio, modo="stream", resultado="ok")
+                self._registrar_exito()
+                registrado = True
+                return
+            finally:
+                self._cupos().release()
+                if not registrado:
+                    # Stream abandonado (el navegador se desconectó, GeneratorExit): sin
+                    # resultado que registrar, pero la llamada de prueba debe quedar libre.
+                    with self._lock:
+                        self._prueba_en_curso = False
+        raise self._agotado(ultimo_error) from ultimo_error
+
+    def estado(self):
+        with self._lock:
+            if self._segundos_abierto():
+                circuito = "abierto"
+            elif self._fallos_seguidos >= current_app.config['IA_CIRCUITO_FALLOS']:
+                circuito = "semiabierto"
+            else:
+                circuito = "cerrado"
+            return {**self.contadores, "circuito": circuito, "fallos_seguidos": self._fallos_seguidos,
+                    "reintentar_en": int(self._segundos_abierto())}
+
+
+cliente_ia = ClienteIA()
+
+def _respuesta_ia_no_disponible(error):
+    """503 con Retry-After para que script.js avise al usuario en lugar de esperar."""
+    respuesta = jsonify({"error": str(error), "reintentar_en": error.reintentar_en})
+    respuesta.status_code = 503
+    if error.reintentar_en:
+        respuesta.headers["Retry-After"] = str(error.reintentar_en)
+    return respuesta
+
+def call_gemini_api(prompt):
+    """Función helper para llamar a la API de Gemini, pasando por la caché de respuestas."""
+    # Solo se cachean respuestas JSON válidas para no repetir una respuesta defectuosa.
+    return cache_ia.obtener(GEMINI_MODEL, prompt, lambda: cliente_ia.generar(prompt), es_cacheable=_es_json_valido)
+
+# --- STREAMING (SERVER-SENT EVENTS) ---
+
+def _evento_sse(evento, datos):
+    return f"event: {evento}\ndata: {json.dumps(datos)}\n\n"
+
+def _cadena_json_parcial(texto, clave):
+    """Valor decodificado (posiblemente incompleto) de la cadena texto[clave] dentro de un JSON a medio recibir."""
+    inicio = re.search(r'"%s"\s*:\s*"' % re.escape(clave), texto)
+    if not inicio:
+        return ""
+    fragmento = texto[inicio.end():]
+    fin = re.search(r'(?<!\\)(?:\\\\)*"', fragmento)
+    if fin:
+        fragmento = fragmento[:fin.end() - 1]
+    # Descartamos una secuencia de escape cortada al final del fragmento.
+    fragmento = re.sub(r'\\(u[0-9a-fA-F]{0,3})?$', '', fragmento)
+    try:
+        return json.loads(f'"{fragmento}"')
+    except ValueError:
+        return ""
+
+def _respuesta_sse(prompt, construir_resultado, clave_parcial=None):
+    """Transmite la respuesta de Gemini como SSE.
+
+    Emite eventos 'parcial' con el texto nuevo ({"texto": ...}), y al final un
+    evento 'fin' con el mismo JSON que devuelve la ruta sin streaming, o
+    'error' si la respuesta completa no es válida.
+    """
+    cacheado = cache_ia.consultar(GEMINI_MODEL, prompt)
+    futuro, es_lider = None, False
+    if cacheado is None:
+        # Las peticiones idénticas que llegan mientras otra transmite esperan su resultado
+        # y lo reciben en un único evento 'fin'.
+        futuro, es_lider = cache_ia.unirse(GEMINI_MODEL, prompt)
+        # Con el circuito abierto y sin respuesta en caché se contesta 503 sin abrir el stream.
+        if es_lider and not cliente_ia.disponible():
+            error = IANoDisponible("El servicio de IA no está disponible temporalmente.",
+                                   reintentar_en=cliente_ia.estado()["reintentar_en"] + 1)
+            cache_ia.terminar(GEMINI_MODEL, prompt, futuro, error=error)
+            return _respuesta_ia_no_disponible(error)
+
+    def generar():
+        completo = cacheado
+        try:
+            if es_lider:
+                partes, enviado = [], ""
+                for texto in cliente_ia.generar_stream(prompt):
+                    partes.append(texto)
+                    acumulado = "".join(partes)
+                    visible = _cadena_json_parcial(acumulado, clave_parcial) if clave_parcial else acumulado
+                    if len(visible) > len(enviado):
+                        yield _evento_sse("parcial", {"texto": visible[len(enviado):]})
+                        enviado = visible
+                completo = "".join(partes)
+                resultado = construir_resultado(completo)
+                cache_ia.almacenar(GEMINI_MODEL, prompt, completo)
+                cache_ia.terminar(GEMINI_MODEL, prompt, futuro, completo)
+            else:
+                if completo is None:
+                    completo = futuro.result()
+                resultado = construir_resultado(completo)
+            yield _evento_sse("fin", resultado)
+        except IANoDisponible as e:
+            if es_lider:
+                cache_ia.terminar(GEMINI_MODEL, prompt, futuro, error=e)
+            yield _evento_sse("error", {"error": str(e), "reintentar_en": e.reintentar_en})
+        except Exception as e:
+            if es_lider:
+                cache_ia.terminar(GEMINI_MODEL, prompt, futuro, error=e)
+            current_app.logger.error(f"Error en streaming de IA: {e}")
+            yield _evento_sse("error", {"error": f"Error al comunicarse con la IA: {str(e)}"})
+        finally:
+            if es_lider:
+                cache_ia.terminar(GEMINI_MODEL, prompt, futuro)
+
+    respuesta = Response(
+        stream_with_context(generar()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    
-    return response.text
+    if es_lider:
+        # Si el stream no llega a iterarse (el cliente se fue antes), los seguidores no deben quedar esperando.
+        respuesta.call_on_close(lambda: cache_ia.terminar(GEMINI_MODEL, prompt, futuro))
+    return respuesta
 
-@app.route('/generar/detalle-sistema', methods=['POST'])
-def generar_detalle_sistema_ia():
-    data = request.json
+@bp.route('/ia/cache/estadisticas')
+def estadisticas_cache_ia():
+    return jsonify(cache_ia.estadisticas())
+
+@bp.route('/ia/estado')
+def estado_cliente_ia():
+    return jsonify(cliente_ia.estado())
+
+def _prompt_detalle_sistema(data):
+    """Valida los datos del formulario y construye el prompt. Devuelve (prompt, error)."""
     clasificacion = data.get('clasificacion', 'general')
     tipo = data.get('tipo', 'preventivo')
     activo = data.get('activo', 'N/A')
@@ -249,7 +1609,7 @@ def generar_detalle_sistema_ia():
     locacion = data.get('locacion', 'N/A') 
 
     if not actividades:
-        return jsonify({"error": "El detalle del mantenimiento del usuario no puede estar vacío."}), 400
+        return None, "El detalle del mantenimiento del usuario no puede estar vacío."
 
     # --- TU PROMPT ORIGINAL (prompt_1) ---
     prompt = f"""
@@ -285,18 +1645,36 @@ Cada paso de la lista de actividades no debe se muy larga, son oraciones concisa
 Las unicas areas existentes son mantenimiento, produccion y seguridad no existen mas para elegir.
 Nautilus es un area que solo es supervisada con mantenimiento.
 """
+    return prompt, None
+
+def _resultado_detalle_sistema(response_text):
+    response_json = json.loads(response_text)
+    detalle_generado = response_json.get("strResultado", "Error: La IA no devolvió la clave 'strResultado'.")
+    return {"detalle": detalle_generado}
+
+@bp.route('/generar/detalle-sistema', methods=['POST'])
+def generar_detalle_sistema_ia():
+    prompt, error = _prompt_detalle_sistema(request.json)
+    if error:
+        return jsonify({"error": error}), 400
     try:
-        response_text = call_gemini_api(prompt)
-        response_json = json.loads(response_text)
-        detalle_generado = response_json.get("strResultado", "Error: La IA no devolvió la clave 'strResultado'.")
-        return jsonify({"detalle": detalle_generado})
+        return jsonify(_resultado_detalle_sistema(call_gemini_api(prompt)))
+    except IANoDisponible as e:
+        return _respuesta_ia_no_disponible(e)
     except Exception as e:
-        app.logger.error(f"Error en generar_detalle_sistema_ia: {e}")
+        current_app.logger.error(f"Error en generar_detalle_sistema_ia: {e}")
         return jsonify({"error": f"Error al comunicarse con la IA: {str(e)}"}), 500
 
-@app.route('/generar/info-estructurada', methods=['POST'])
-def generar_info_estructurada_ia():
-    data = request.json
+@bp.route('/generar/detalle-sistema/stream', methods=['POST'])
+def generar_detalle_sistema_ia_stream():
+    prompt, error = _prompt_detalle_sistema(request.json)
+    if error:
+        return jsonify({"error": error}), 400
+    # El modelo devuelve {"strResultado": "..."}: al navegador solo le enviamos el texto de esa clave.
+    return _respuesta_sse(prompt, _resultado_detalle_sistema, clave_parcial="strResultado")
+
+def _prompt_info_estructurada(data):
+    """Valida los datos del formulario y construye el prompt. Devuelve (prompt, error)."""
     clasificacion = data.get('clasificacion', 'general')
     tipo = data.get('tipo', 'preventivo')
     activo = data.get('activo', 'N/A')
@@ -304,7 +1682,7 @@ def generar_info_estructurada_ia():
     detalle_sistema = data.get('detalle_sistema', '') # Esto es el strResultado1 de tu script
 
     if not detalle_sistema:
-        return jsonify({"error": "El detalle del sistema generado por IA no puede estar vacío."}), 400
+        return None, "El detalle del sistema generado por IA no puede estar vacío."
 
     # --- TU PLANTILLA JSON ORIGINAL (json_base) ---
     json_base_plantilla = """
@@ -364,77 +1742,332 @@ del area respectiva para poder hacer la documentacion correspondiente, para esto
 3. Areas:
   Las unicas areas existentes son mantenimiento, produccion y seguridad no existen mas areas para elegir.
 """
+    return prompt, None
+
+def _resultado_info_estructurada(response_text):
+    response_json = json.loads(response_text)
+    info_generada = json.dumps(response_json, indent=2)
+    return {"info": info_generada}
+
+@bp.route('/generar/info-estructurada', methods=['POST'])
+def generar_info_estructurada_ia():
+    prompt, error = _prompt_info_estructurada(request.json)
+    if error:
+        return jsonify({"error": error}), 400
     try:
-        response_text = call_gemini_api(prompt)
-        response_json = json.loads(response_text)
-        info_generada = json.dumps(response_json, indent=2)
-        return jsonify({"info": info_generada})
+        return jsonify(_resultado_info_estructurada(call_gemini_api(prompt)))
+    except IANoDisponible as e:
+        return _respuesta_ia_no_disponible(e)
     except Exception as e:
-        app.logger.error(f"Error en generar_info_estructurada_ia: {e}")
+        current_app.logger.error(f"Error en generar_info_estructurada_ia: {e}")
         return jsonify({"error": f"Error al comunicarse con la IA: {str(e)}"}), 500
 
-@app.route('/generar-reporte-word/<int:id>', methods=['POST'])
-def generar_reporte_word(id):
-    mant = Mantenimiento.query.get_or_404(id)
+@bp.route('/generar/info-estructurada/stream', methods=['POST'])
+def generar_info_estructurada_ia_stream():
+    prompt, error = _prompt_info_estructurada(request.json)
+    if error:
+        return jsonify({"error": error}), 400
+    return _respuesta_sse(prompt, _resultado_info_estructurada)
 
-    if not all([mant.informacion_estructurada, mant.autor, mant.supervisor, mant.fecha_realizacion]):
-        return jsonify({"error": "Faltan datos clave (Info. Estructurada, Autor, Supervisor o Fecha)."}), 400
+# --- GENERACIÓN DE REPORTES WORD (COLA DE TRABAJOS EN SEGUNDO PLANO) ---
+
+PLANTILLA_MANTENIMIENTO = 'plantilla_mantenimiento.docx'
+
+class CachePlantillas:
+    """Caché por proceso de plantillas Word ya descomprimidas y parseadas.
+
+    Cada plantilla se identifica por su nombre de archivo dentro de
+    WORD_TEMPLATE_FOLDER. Se revalida con un stat() en cada uso: si cambian el
+    mtime o el tamaño se recalcula el hash del contenido y, solo si este
+    difiere, se vuelve a parsear. Cada render recibe una copia en memoria del
+    documento base, que nunca se modifica.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entradas = {}
+
+    def _entrada(self, nombre):
+        ruta = os.path.join(current_app.config['WORD_TEMPLATE_FOLDER'], nombre)
+        st = os.stat(ruta)
+        with self._lock:
+            entrada = self._entradas.get(nombre)
+            if entrada and (entrada["mtime_ns"], entrada["size"]) == (st.st_mtime_ns, st.st_size):
+                return ruta, entrada
+            with open(ruta, 'rb') as f:
+                contenido = f.read()
+            hash_contenido = hashlib.sha256(contenido).hexdigest()
+            if not entrada or entrada["hash"] != hash_contenido:
+                current_app.logger.info(f"Cargando plantilla Word '{nombre}' en caché.")
+                from docx import Document
+                entrada = {"hash": hash_contenido, "documento": Document(io.BytesIO(contenido))}
+            entrada.update(mtime_ns=st.st_mtime_ns, size=st.st_size)
+            self._entradas[nombre] = entrada
+            return ruta, entrada
+
+    def obtener(self, nombre):
+        """Devuelve un DocxTemplate listo para renderizar, a partir de la copia en caché."""
+        ruta, entrada = self._entrada(nombre)
+        from docxtpl import DocxTemplate
+        tpl = DocxTemplate(ruta)
+        tpl.docx = copy.deepcopy(entrada["documento"])
+        return tpl
 
+    def version(self, nombre):
+        """Hash SHA-256 del contenido actual de la plantilla."""
+        return self._entrada(nombre)[1]["hash"]
+
+    def invalidar(self, nombre=None):
+        with self._lock:
+            if nombre is None:
+                self._entradas.clear()
+            else:
+                self._entradas.pop(nombre, None)
+
+
+cache_plantillas = CachePlantillas()
+
+def _huella_evidencia(nombre):
+    """Identifica el contenido de una evidencia; los blobs por hash ya lo llevan en el nombre."""
+    if _PATRON_NOMBRE_CONTENIDO.match(nombre):
+        return nombre
     try:
-        # Si ya existe un reporte, lo eliminamos del sistema de archivos.
-        if mant.nombre_archivo_reporte:
-            ruta_antigua = os.path.join(app.config['GENERATED_REPORTS_FOLDER'], mant.nombre_archivo_reporte)
-            if os.path.exists(ruta_antigua):
-                os.remove(ruta_antigua)
-
-        template_path = os.path.join(app.config['WORD_TEMPLATE_FOLDER'], 'plantilla_mantenimiento.docx')
-        tpl = DocxTemplate(template_path)
-
-        context = json.loads(mant.informacion_estructurada)
-        context['locacion'] = mant.locacion
-        context['autor'] = mant.autor
-        context['supervisor'] = mant.supervisor
-        context['fecha_ejecucion'] = mant.fecha_realizacion.strftime('%d-%m-%Y')
-        context['fecha_emision'] = date.today().strftime('%d-%m-%Y')
-
-        lista_imagenes = []
-        for evidencia in mant.evidencias:
-            path_img = os.path.join(app.config['UPLOAD_FOLDER'], evidencia.nombre_archivo)
-            if os.path.exists(path_img):
-                img = InlineImage(tpl, path_img, height=Cm(5))
-                lista_imagenes.append(img)
-        context['evidencias'] = lista_imagenes
+        return _hash_archivo(os.path.join(current_app.config['UPLOAD_FOLDER'], nombre))
+    except OSError:
+        return None
+
+def huella_reporte(mant):
+    """Hash de todo lo que determina el contenido del reporte Word de un mantenimiento.
+
+    La fecha de emisión no entra: un reporte sin cambios conserva la fecha en que se emitió.
+    """
+    datos = {
+        "informacion_estructurada": mant.informacion_estructurada,
+        "autor": mant.autor,
+        "supervisor": mant.supervisor,
+        "locacion": mant.locacion,
+        "fecha": mant.fecha_realizacion.isoformat() if mant.fecha_realizacion else None,
+        "evidencias": [
+            (archivo_evidencia(e.nombre_archivo, 'reporte'), _huella_evidencia(e.nombre_archivo))
+            for e in sorted(mant.evidencias, key=lambda e: e.id)
+        ],
+        "plantilla": cache_plantillas.version(PLANTILLA_MANTENIMIENTO),
+    }
+    return hashlib.sha256(json.dumps(datos, sort_keys=True).encode('utf-8')).hexdigest()
+
+def reporte_listo(mant, huella=None):
+    """True si el archivo del reporte existe y se generó con los datos actuales."""
+    if not mant.nombre_archivo_reporte or not mant.huella_reporte:
+        return False
+    if not os.path.exists(os.path.join(current_app.config['GENERATED_REPORTS_FOLDER'], mant.nombre_archivo_reporte)):
+        return False
+    return mant.huella_reporte == (huella or huella_reporte(mant))
+
+def construir_reporte_word(id):
+    """Renderiza el reporte Word de un mantenimiento y lo guarda en disco. Devuelve el nombre del archivo.
+
+    Si la huella de los datos coincide con la del reporte existente, no se vuelve a renderizar.
+    """
+    mant = Mantenimiento.query.get(id)
+    if not mant:
+        raise LookupError(f"Mantenimiento #{id} no encontrado.")
+
+    huella = huella_reporte(mant)
+    if reporte_listo(mant, huella):
+        return mant.nombre_archivo_reporte
 
+    from docxtpl import InlineImage
+    from docx.shared import Cm
+
+    tpl = cache_plantillas.obtener(PLANTILLA_MANTENIMIENTO)
+
+    context = json.loads(mant.informacion_estructurada)
+    context['locacion'] = mant.locacion
+    context['autor'] = mant.autor
+    context['supervisor'] = mant.supervisor
+    context['fecha_ejecucion'] = mant.fecha_realizacion.strftime('%d-%m-%Y')
+    context['fecha_emision'] = date.today().strftime('%d-%m-%Y')
+
+    lista_imagenes = []
+    for evidencia in mant.evidencias:
+        path_img = os.path.join(current_app.config['UPLOAD_FOLDER'], archivo_evidencia(evidencia.nombre_archivo, 'reporte'))
+        if os.path.exists(path_img):
+            img = InlineImage(tpl, path_img, height=Cm(5))
+            lista_imagenes.append(img)
+    context['evidencias'] = lista_imagenes
+
+    with METRICAS["reporte_render"].cronometrar():
         tpl.render(context, autoescape=True)
 
-        # --- CAMBIO: Volvemos a un nombre de archivo simple y predecible para el almacenamiento ---
-        nombre_archivo_almacenado = f"reporte_mantenimiento_{id}.docx"
-        
-        ruta_guardado = os.path.join(app.config['GENERATED_REPORTS_FOLDER'], nombre_archivo_almacenado)
-        tpl.save(ruta_guardado)
-        
-        mant.nombre_archivo_reporte = nombre_archivo_almacenado
+    # --- CAMBIO: Volvemos a un nombre de archivo simple y predecible para el almacenamiento ---
+    nombre_archivo_almacenado = f"reporte_mantenimiento_{id}.docx"
+    carpeta = current_app.config['GENERATED_REPORTS_FOLDER']
+    ruta_guardado = os.path.join(carpeta, nombre_archivo_almacenado)
+
+    # Se escribe en un temporal de la misma carpeta y se sustituye de una vez,
+    # así una descarga en curso nunca lee un reporte a medio escribir.
+    fd, ruta_temporal = tempfile.mkstemp(prefix='.reporte-', suffix='.docx', dir=carpeta)
+    try:
+        with os.fdopen(fd, 'wb') as destino, METRICAS["reporte_guardado"].cronometrar():
+            tpl.save(destino)
+        hash_nuevo = _hash_archivo(ruta_temporal)
+        os.replace(ruta_temporal, ruta_guardado)
+    except BaseException:
+        if os.path.exists(ruta_temporal):
+            os.remove(ruta_temporal)
+        raise
+
+    # Reportes antiguos guardados con otro nombre ya no se referencian.
+    if mant.nombre_archivo_reporte and mant.nombre_archivo_reporte != nombre_archivo_almacenado:
+        ruta_antigua = os.path.join(carpeta, mant.nombre_archivo_reporte)
+        if os.path.exists(ruta_antigua):
+            os.remove(ruta_antigua)
+
+    mant.nombre_archivo_reporte = nombre_archivo_almacenado
+    mant.nombre_descarga = nombre_descarga_reporte(mant)
+    mant.hash_reporte = hash_nuevo
+    mant.huella_reporte = huella
+    db.session.commit()
+    return nombre_archivo_almacenado
+
+
+class ColaReportes:
+    """Ejecuta la generación de reportes en un pool de hilos local.
+
+    El estado de cada trabajo se guarda en la tabla trabajo_reporte, así que
+    con varios workers la consulta de estado puede llegar a cualquiera de
+    ellos. Un mismo mantenimiento no tiene dos trabajos en curso: si se
+    vuelve a encolar mientras el anterior está pendiente o en proceso, se
+    devuelve el trabajo existente (dos workers que encolan a la vez el mismo
+    mantenimiento pueden generarlo dos veces; el resultado es el mismo). El
+    tamaño del pool limita cuántos reportes renderiza cada worker a la vez.
+    """
+
+    # Tiempo (en segundos) que se conserva el estado de un trabajo terminado.
+    RETENCION = 600
+    # Un trabajo sin terminar tras este plazo se da por perdido (p. ej. su worker se reinició).
+    PLAZO_MAXIMO = 600
+
+    def __init__(self):
+        # El pool se crea con el primer trabajo, con el tamaño que indique la configuración.
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def encolar(self, mantenimiento_id):
+        """Devuelve (trabajo, es_nuevo) para el mantenimiento indicado."""
+        ahora = _ahora_utc()
+        TrabajoReporte.query.filter(
+            TrabajoReporte.terminado_en < ahora - timedelta(seconds=self.RETENCION)
+        ).delete(synchronize_session=False)
+        existente = TrabajoReporte.query.filter(
+            TrabajoReporte.mantenimiento_id == mantenimiento_id,
+            TrabajoReporte.estado.in_(("pendiente", "en_proceso")),
+            TrabajoReporte.creado_en >= ahora - timedelta(seconds=self.PLAZO_MAXIMO),
+        ).first()
+        if existente:
+            db.session.commit()
+            return self._a_dict(existente), False
+        trabajo = TrabajoReporte(id=uuid.uuid4().hex, mantenimiento_id=mantenimiento_id, creado_en=ahora)
+        db.session.add(trabajo)
         db.session.commit()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=current_app.config['REPORTES_MAX_TRABAJOS'], thread_name_prefix="reportes"
+                )
+        self._executor.submit(self._ejecutar, current_app._get_current_object(), trabajo.id, mantenimiento_id)
+        return self._a_dict(trabajo), True
 
-        return jsonify({"success": True, "filename": nombre_archivo_almacenado, "message": "Reporte generado/actualizado con éxito."})
+    def estado(self, trabajo_id):
+        trabajo = db.session.get(TrabajoReporte, trabajo_id)
+        if not trabajo:
+            return None
+        datos = self._a_dict(trabajo)
+        if not trabajo.terminado_en and trabajo.creado_en < _ahora_utc() - timedelta(seconds=self.PLAZO_MAXIMO):
+            datos.update(estado="error", error="El trabajo se interrumpió antes de terminar. Vuelve a generar el reporte.")
+        return datos
 
-    except json.JSONDecodeError:
-        return jsonify({"error": "La información estructurada no es un JSON válido."}), 500
-    except Exception as e:
-        app.logger.error(f"Error generando reporte para ID {id}: {e}")
-        return jsonify({"error": f"Error inesperado al generar el documento: {str(e)}"}), 500
+    @staticmethod
+    def _a_dict(trabajo):
+        return {
+            "id": trabajo.id,
+            "mantenimiento_id": trabajo.mantenimiento_id,
+            "estado": trabajo.estado,
+            "filename": trabajo.filename,
+            "error": trabajo.error,
+        }
 
+    @staticmethod
+    def _actualizar(trabajo_id, **campos):
+        if campos["estado"] in ("completado", "error"):
+            campos["terminado_en"] = _ahora_utc()
+        TrabajoReporte.query.filter_by(id=trabajo_id).update(campos, synchronize_session=False)
+        db.session.commit()
 
-@app.route('/descargar-reporte/<filename>')
-def descargar_reporte(filename):
-    # --- LÓGICA MEJORADA PARA CAMBIAR EL NOMBRE AL DESCARGAR ---
-    
-    # 1. Buscar el mantenimiento que corresponde a este nombre de archivo
-    mant = Mantenimiento.query.filter_by(nombre_archivo_reporte=filename).first_or_404()
-    
-    nombre_descarga = filename # Nombre por defecto si algo falla
+    def _ejecutar(self, app, trabajo_id, mantenimiento_id):
+        with app.app_context():
+            try:
+                self._actualizar(trabajo_id, estado="en_proceso")
+                filename = construir_reporte_word(mantenimiento_id)
+                self._actualizar(trabajo_id, estado="completado", filename=filename)
+            except json.JSONDecodeError:
+                db.session.rollback()
+                self._actualizar(trabajo_id, estado="error", error="La información estructurada no es un JSON válido.")
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Error generando reporte para ID {mantenimiento_id}: {e}")
+                self._actualizar(trabajo_id, estado="error", error=f"Error inesperado al generar el documento: {str(e)}")
+
+
+cola_reportes = ColaReportes()
+
+def _trabajo_a_json(trabajo):
+    return {
+        "job_id": trabajo["id"],
+        "mantenimiento_id": trabajo["mantenimiento_id"],
+        "estado": trabajo["estado"],
+        "filename": trabajo["filename"],
+        "error": trabajo["error"],
+        "url_estado": url_for('principal.estado_trabajo_reporte', job_id=trabajo["id"]),
+    }
+
+@bp.route('/generar-reporte-word/<int:id>', methods=['POST'])
+def generar_reporte_word(id):
+    mant = Mantenimiento.query.get_or_404(id)
+
+    if not all([mant.informacion_estructurada, mant.autor, mant.supervisor, mant.fecha_realizacion]):
+        return jsonify({"error": "Faltan datos clave (Info. Estructurada, Autor, Supervisor o Fecha)."}), 400
+
+    # Sin cambios desde la última generación: se devuelve el reporte existente sin encolar nada.
+    if reporte_listo(mant):
+        return jsonify({
+            "job_id": None,
+            "mantenimiento_id": mant.id,
+            "estado": "completado",
+            "filename": mant.nombre_archivo_reporte,
+            "error": None,
+            "url_estado": None,
+            "message": "El reporte ya estaba al día.",
+        })
+
+    trabajo, es_nuevo = cola_reportes.encolar(id)
+    return jsonify(_trabajo_a_json(trabajo)), 202 if es_nuevo else 200
+
+@bp.route('/reportes/trabajos/<job_id>')
+def estado_trabajo_reporte(job_id):
+    trabajo = cola_reportes.estado(job_id)
+    if not trabajo:
+        return jsonify({"error": "Trabajo no encontrado o expirado."}), 404
+    respuesta = _trabajo_a_json(trabajo)
+    if trabajo["estado"] == "completado":
+        respuesta["message"] = "Reporte generado/actualizado con éxito."
+    return jsonify(respuesta)
+
+
+def nombre_descarga_reporte(mant):
+    """Nombre descriptivo del .docx a partir de strTituloDocumento, o el nombre almacenado si no hay título."""
+    nombre_descarga = mant.nombre_archivo_reporte # Nombre por defecto si algo falla
 
-    # 2. Intentar obtener el nombre descriptivo del JSON
     if mant.informacion_estructurada:
         try:
             data = json.loads(mant.informacion_estructurada)
@@ -443,36 +2076,910 @@ def descargar_reporte(filename):
             if titulo_documento:
                 # Sanear el título y añadirle la extensión .docx
                 nombre_descarga = f"{secure_filename(titulo_documento)}.docx"
-        except (json.JSONDecodeError, TypeError):
+        except (json.JSONDecodeError, TypeError, AttributeError):
             # Si el JSON es inválido o no es un string, usamos el nombre por defecto
-            app.logger.warning(f"No se pudo parsear el JSON para el reporte {filename}. Usando nombre de archivo por defecto.")
-            pass
+            current_app.logger.warning(f"No se pudo parsear el JSON para el reporte {mant.nombre_archivo_reporte}. Usando nombre de archivo por defecto.")
+    return nombre_descarga
 
-    # 3. Servir el archivo desde el disco, pero decirle al navegador que use el nuevo nombre_descarga
-    return send_from_directory(
-        directory=app.config['GENERATED_REPORTS_FOLDER'],
-        path=filename,
-        download_name=nombre_descarga, # ¡Esta es la magia!
+@bp.route('/descargar-reporte/<filename>')
+def descargar_reporte(filename):
+    # Buscar el mantenimiento que corresponde a este nombre de archivo (solo las columnas necesarias)
+    mant = (Mantenimiento.query
+            .options(db.load_only(Mantenimiento.nombre_archivo_reporte, Mantenimiento.nombre_descarga, Mantenimiento.hash_reporte))
+            .filter_by(nombre_archivo_reporte=filename).first_or_404())
+
+    # Servir el archivo desde el disco, pero decirle al navegador que use el nombre descriptivo.
+    # Los reportes generados antes de guardar estos datos los calculan al vuelo.
+    return servir_archivo(
+        current_app.config['GENERATED_REPORTS_FOLDER'], filename, 'reportes',
+        etag=mant.hash_reporte or True,
+        download_name=mant.nombre_descarga or nombre_descarga_reporte(mant),
         as_attachment=True
     )
 
 
+# --- EXPORTACIÓN MASIVA DE REPORTES (ZIP EN STREAMING) ---
+
+_pool_procesos = None
+_pool_procesos_lock = threading.Lock()
+_app_proceso = None
+
+def _inicializar_proceso_reportes(config):
+    # Cada proceso hijo crea su propia aplicación (y sus conexiones a la base de datos)
+    # con la configuración del proceso padre.
+    global _app_proceso
+    _app_proceso = create_app(config)
+
+def _renderizar_en_proceso(id):
+    with _app_proceso.app_context():
+        return construir_reporte_word(id)
+
+def pool_procesos_reportes():
+    """Pool de procesos compartido para renderizar reportes en paralelo (se crea al primer uso)."""
+    global _pool_procesos
+    with _pool_procesos_lock:
+        if _pool_procesos is None:
+            _pool_procesos = ProcessPoolExecutor(
+                max_workers=current_app.config['REPORTES_MAX_PROCESOS'],
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_inicializar_proceso_reportes,
+                initargs=({
+                    clave: valor for clave, valor in current_app.config.items()
+                    if isinstance(valor, (str, int, float, bool, type(None)))
+                },),
+            )
+        return _pool_procesos
+
+def _descartar_pool_procesos(pool):
+    """Olvida un pool roto (p. ej. un hijo murió) para que el siguiente uso cree uno nuevo."""
+    global _pool_procesos
+    with _pool_procesos_lock:
+        if _pool_procesos is pool:
+            _pool_procesos = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+class _SalidaZip(io.RawIOBase):
+    """Destino no buscable para ZipFile: acumula lo escrito hasta que se vacía hacia la respuesta."""
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def vaciar(self):
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
+
+def generar_zip_reportes(mantenimientos, tam_bloque=256 * 1024):
+    """Genera el ZIP de los reportes por bloques, renderizando en paralelo los que faltan o están desactualizados.
+
+    Los reportes ya vigentes se envían primero mientras el pool de procesos
+    renderiza el resto; cada uno se agrega al ZIP en cuanto termina.
+    """
+    listos, pendientes, omitidos = [], {}, []
+    for mant in mantenimientos:
+        if not all([mant.informacion_estructurada, mant.autor, mant.supervisor, mant.fecha_realizacion]):
+            omitidos.append(f"#{mant.id}: faltan datos clave (Info. Estructurada, Autor, Supervisor o Fecha).")
+        elif reporte_listo(mant):
+            listos.append(mant)
+        else:
+            pendientes[mant.id] = mant
+    pool = pool_procesos_reportes()
+    futuros = {pool.submit(_renderizar_en_proceso, id): id for id in pendientes}
+
+    salida = _SalidaZip()
+    nombres_usados = set()
+    with zipfile.ZipFile(salida, "w", compression=zipfile.ZIP_STORED) as zf:
+        def agregar(mant):
+            nombre = nombre_descarga_reporte(mant)
+            if nombre in nombres_usados:
+                base, ext = os.path.splitext(nombre)
+                nombre = f"{base}_{mant.id}{ext}"
+            nombres_usados.add(nombre)
+            ruta = os.path.join(current_app.config['GENERATED_REPORTS_FOLDER'], mant.nombre_archivo_reporte)
+            with open(ruta, "rb") as origen, zf.open(nombre, "w", force_zip64=True) as destino:
+                while bloque := origen.read(tam_bloque):
+                    destino.write(bloque)
+                    yield salida.vaciar()
+            yield salida.vaciar()
+
+        for mant in listos:
+            yield from agregar(mant)
+
+        for futuro in as_completed(futuros):
+            mant = pendientes[futuros[futuro]]
+            try:
+                mant.nombre_archivo_reporte = futuro.result()
+            except BrokenProcessPool as e:
+                _descartar_pool_procesos(pool)
+                omitidos.append(f"#{mant.id}: error al generar el documento: {e}")
+                continue
+            except Exception as e:
+                current_app.logger.error(f"Error generando reporte para ID {mant.id}: {e}")
+                omitidos.append(f"#{mant.id}: error al generar el documento: {e}")
+                continue
+            yield from agregar(mant)
+
+        if omitidos:
+            zf.writestr("reportes_omitidos.txt", "\n".join(omitidos) + "\n")
+    yield salida.vaciar()
+
+def nombre_zip_reportes(mes=None, area=None):
+    partes = ["reportes"]
+    if mes:
+        partes.append(MESES.get(mes, str(mes)))
+    if area:
+        partes.append(area)
+    return secure_filename("_".join(partes)) + ".zip"
+
+@bp.route('/exportar-reportes')
+def exportar_reportes():
+    mes_filtrado = request.args.get('mes', type=int)
+    area_filtrada = request.args.get('area', type=str)
+    mantenimientos = consulta_mantenimientos(mes_filtrado, area_filtrada).options(db.selectinload(Mantenimiento.evidencias)).all()
+    return Response(
+        stream_with_context(generar_zip_reportes(mantenimientos)),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{nombre_zip_reportes(mes_filtrado, area_filtrada)}"'},
+    )
+
+
+# --- IMPORTACIÓN MASIVA DEL PLAN ANUAL (CSV / XLSX) ---
+# El archivo se lee fila a fila y se inserta por lotes. Cada fila se identifica
+# por codigo_mantenimiento: las que ya existen en la base se omiten, así que
+# volver a importar el mismo archivo no duplica registros.
+
+COLUMNAS_OBLIGATORIAS = ('codigo_mantenimiento', 'descripcion_activo', 'locacion', 'clase', 'mes_programado')
+ALIAS_COLUMNAS = {
+    'codigo': 'codigo_mantenimiento',
+    'activo': 'descripcion_activo',
+    'clasificacion': 'clase',
+    'mes': 'mes_programado',
+    'tipo': 'tipo_mantenimiento',
+}
+COLUMNAS_INSERCION = ('area', 'locacion', 'tipo_mantenimiento', 'descripcion_activo', 'codigo_mantenimiento',
+                      'mes_programado', 'estado', 'clase_id', 'actualizado_en')
+MAX_ERRORES_REPORTADOS = 500
+
+def _normalizar(texto):
+    """Minúsculas y sin tildes, para comparar encabezados, meses, clases y áreas."""
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode('ascii')
+    return " ".join(texto.lower().split())
+
+def _nombre_columna(encabezado):
+    nombre = _normalizar(encabezado or '').replace(' ', '_')
+    return ALIAS_COLUMNAS.get(nombre, nombre)
+
+def _filas_csv(archivo):
+    texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+    primera = texto.readline()
+    # Excel en configuración regional española exporta con ';'.
+    delimitador = ';' if primera.count(';') > primera.count(',') else ','
+    lector = csv.reader(itertools.chain([primera], texto), delimiter=delimitador)
+    yield from lector
+
+def _filas_xlsx(archivo):
+    try:
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError:
+        raise ValueError("Instala openpyxl para importar archivos .xlsx.")
+    # Un .xlsx es un ZIP: si está dañado o no lo es, falla al abrirlo o al leer sus hojas.
+    errores_libro = (zipfile.BadZipFile, InvalidFileException, KeyError, EOFError)
+    try:
+        libro = load_workbook(archivo, read_only=True, data_only=True)
+    except errores_libro as e:
+        raise ValueError("El archivo .xlsx está dañado o no es un libro de Excel válido.") from e
+    try:
+        for fila in libro.active.iter_rows(values_only=True):
+            yield ["" if valor is None else valor for valor in fila]
+    except errores_libro as e:
+        raise ValueError("El archivo .xlsx está dañado o no es un libro de Excel válido.") from e
+    finally:
+        libro.close()
+
+def leer_plan(archivo, nombre_archivo):
+    """Genera (número de fila, dict) por cada fila de datos del CSV/XLSX, sin cargar el archivo completo."""
+    extension = os.path.splitext(nombre_archivo)[1].lower()
+    if extension == '.xlsx':
+        filas = _filas_xlsx(archivo)
+    elif extension in ('.csv', '.txt'):
+        filas = _filas_csv(archivo)
+    else:
+        raise ValueError("Formato no soportado: usa un archivo .csv o .xlsx.")
+
+    encabezados = [_nombre_columna(h) for h in next(filas, [])]
+    faltantes = [c for c in COLUMNAS_OBLIGATORIAS if c not in encabezados]
+    if faltantes:
+        raise ValueError(f"Faltan columnas obligatorias: {', '.join(faltantes)}.")
+    for numero, fila in enumerate(filas, start=2):
+        if any(str(valor).strip() for valor in fila):
+            yield numero, dict(zip(encabezados, fila))
+
+def _mes_desde_valor(valor):
+    texto = _normalizar(valor)
+    if texto.replace('.0', '').isdigit():
+        mes = int(float(texto))
+        return mes if mes in MESES else None
+    return next((num for num, nombre in MESES.items() if _normalizar(nombre) == texto), None)
+
+def _validar_fila_plan(fila, clases, areas, area_por_defecto):
+    """Convierte una fila del archivo en los valores a insertar. Devuelve (valores, error)."""
+    valores = {c: str(fila.get(c, '')).strip() for c in COLUMNAS_OBLIGATORIAS}
+    vacias = [c for c, v in valores.items() if not v]
+    if vacias:
+        return None, f"Campos vacíos: {', '.join(vacias)}."
+
+    clase_id = clases.get(_normalizar(valores['clase']))
+    if not clase_id:
+        return None, f"Clase desconocida: '{valores['clase']}'."
+    mes = _mes_desde_valor(valores['mes_programado'])
+    if not mes:
+        return None, f"Mes programado inválido: '{valores['mes_programado']}'."
+    area_texto = str(fila.get('area', '')).strip() or area_por_defecto or ''
+    area = areas.get(_normalizar(area_texto))
+    if not area:
+        return None, f"Área inválida o vacía: '{area_texto}'."
+    tipo = str(fila.get('tipo_mantenimiento', '')).strip().capitalize() or 'Preventivo'
+    if tipo not in ('Preventivo', 'Correctivo'):
+        return None, f"Tipo de mantenimiento inválido: '{tipo}'."
+
+    for campo, columna in (('codigo_mantenimiento', Mantenimiento.codigo_mantenimiento),
+                           ('descripcion_activo', Mantenimiento.descripcion_activo),
+                           ('locacion', Mantenimiento.locacion)):
+        if len(valores[campo]) > columna.type.length:
+            return None, f"El campo {campo} supera los {columna.type.length} caracteres."
+
+    return {
+        'area': area,
+        'locacion': valores['locacion'],
+        'tipo_mantenimiento': tipo,
+        'descripcion_activo': valores['descripcion_activo'],
+        'codigo_mantenimiento': valores['codigo_mantenimiento'],
+        'mes_programado': mes,
+        'estado': 'Programado',
+        'clase_id': clase_id,
+    }, None
+
+def _insertar_lote_plan(lote):
+    """Inserta un lote con COPY en PostgreSQL o con executemany en otros motores."""
+    conexion = db.session.connection()
+    if conexion.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        for valores in lote:
+            escritor.writerow([valores[c] for c in COLUMNAS_INSERCION])
+        buffer.seek(0)
+        with conexion.connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY mantenimiento ({', '.join(COLUMNAS_INSERCION)}) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+    else:
+        conexion.execute(Mantenimiento.__table__.insert(), lote)
+
+def importar_plan(filas, area_por_defecto=None, tamano_lote=1000):
+    """Importa las filas de leer_plan() por lotes y devuelve un resumen con los errores por fila."""
+    clases = {_normalizar(nombre): id for id, nombre in db.session.query(Clase.id, Clase.nombre)}
+    areas = {_normalizar(area): area for area in AREAS}
+    resultado = {"insertadas": 0, "existentes": 0, "errores": [], "total_errores": 0}
+    vistos = set()
+
+    def registrar_error(numero, mensaje):
+        resultado["total_errores"] += 1
+        if len(resultado["errores"]) < MAX_ERRORES_REPORTADOS:
+            resultado["errores"].append((numero, mensaje))
+
+    def volcar(lote):
+        codigos = [valores['codigo_mantenimiento'] for _, valores in lote]
+        existentes = {c for (c,) in db.session.query(Mantenimiento.codigo_mantenimiento)
+                      .filter(Mantenimiento.codigo_mantenimiento.in_(codigos))}
+        nuevos = [valores for _, valores in lote if valores['codigo_mantenimiento'] not in existentes]
+        if nuevos:
+            ahora = _ahora_utc()
+            for valores in nuevos:
+                valores['actualizado_en'] = ahora
+            _insertar_lote_plan(nuevos)
+            ajustar_resumen(Counter((v['mes_programado'], v['area'], v['clase_id'], v['estado']) for v in nuevos))
+        db.session.commit()
+        resultado["insertadas"] += len(nuevos)
+        resultado["existentes"] += len(lote) - len(nuevos)
+
+    lote = []
+    for numero, fila in filas:
+        valores, error = _validar_fila_plan(fila, clases, areas, area_por_defecto)
+        if error:
+            registrar_error(numero, error)
+            continue
+        if valores['codigo_mantenimiento'] in vistos:
+            registrar_error(numero, f"Código repetido en el archivo: '{valores['codigo_mantenimiento']}'.")
+            continue
+        vistos.add(valores['codigo_mantenimiento'])
+        lote.append((numero, valores))
+        if len(lote) >= tamano_lote:
+            volcar(lote)
+            lote = []
+    if lote:
+        volcar(lote)
+    return resultado
+
+@bp.route('/importar', methods=['GET', 'POST'])
+def importar_plan_anual():
+    resultado = None
+    if request.method == 'POST':
+        archivo = request.files.get('archivo')
+        if not archivo or not archivo.filename:
+            flash("Selecciona un archivo CSV o XLSX.", "danger")
+            return redirect(url_for('principal.importar_plan_anual'))
+        try:
+            resultado = importar_plan(leer_plan(archivo.stream, archivo.filename),
+                                      area_por_defecto=request.form.get('area') or None)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            db.session.rollback()
+            flash(f"No se pudo leer el archivo: {e}", "danger")
+            return redirect(url_for('principal.importar_plan_anual'))
+        flash(f"Importación terminada: {resultado['insertadas']} creados, {resultado['existentes']} ya existían, "
+              f"{resultado['total_errores']} filas con errores.", "success" if not resultado['total_errores'] else "warning")
+    return render_template("importar.html", areas=AREAS, resultado=resultado, columnas=COLUMNAS_OBLIGATORIAS)
+
+
+# --- PANEL DE CUMPLIMIENTO (RESUMEN INCREMENTAL) ---
+# El panel lee la tabla resumen_mantenimiento, que tiene una fila por
+# combinación de mes, área, clase y estado: su costo depende de esas
+# combinaciones y no del número de mantenimientos.
+
+ESTADOS = ("Programado", "Realizado", "Cancelado")
+
+def clave_resumen(mant):
+    return (mant.mes_programado, mant.area, mant.clase_id, mant.estado)
+
+def ajustar_resumen(cambios):
+    """Suma a resumen_mantenimiento los deltas {(mes, area, clase_id, estado): n} en la transacción actual."""
+    tabla = ResumenMantenimiento.__table__
+    conexion = db.session.connection()
+    insertar = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}.get(conexion.dialect.name)
+    for (mes, area, clase_id, estado), delta in cambios.items():
+        if not delta:
+            continue
+        clave = dict(mes_programado=mes, area=area, clase_id=clase_id, estado=estado)
+        filtro = [tabla.c[columna] == valor for columna, valor in clave.items()]
+        if insertar:
+            # Un único INSERT ... ON CONFLICT DO UPDATE: atómico frente a guardados concurrentes.
+            sentencia = insertar(tabla).values(**clave, total=delta)
+            conexion.execute(sentencia.on_conflict_do_update(
+                index_elements=list(clave), set_={"total": tabla.c.total + sentencia.excluded.total}
+            ))
+        elif not conexion.execute(tabla.update().where(*filtro).values(total=tabla.c.total + delta)).rowcount:
+            conexion.execute(tabla.insert().values(**clave, total=delta))
+        if delta < 0:
+            conexion.execute(tabla.delete().where(*filtro, tabla.c.total <= 0))
+
+def reconstruir_resumen():
+    """Recalcula resumen_mantenimiento completo a partir de la tabla de mantenimientos."""
+    tabla = ResumenMantenimiento.__table__
+    columnas = (Mantenimiento.mes_programado, Mantenimiento.area, Mantenimiento.clase_id, Mantenimiento.estado)
+    conexion = db.session.connection()
+    if conexion.dialect.name == 'postgresql':
+        # Evita que un guardado concurrente quede fuera del recálculo.
+        conexion.exec_driver_sql("LOCK TABLE mantenimiento IN SHARE MODE")
+    conexion.execute(tabla.delete())
+    conexion.execute(tabla.insert().from_select(
+        [c.key for c in columnas] + ['total'],
+        db.select(*columnas, db.func.count()).group_by(*columnas),
+    ))
+    db.session.commit()
+
+def resumen_cumplimiento(mes=None, area=None, clase_id=None):
+    """Filas del panel (una por mes, área y clase) con el conteo por estado y los totales generales."""
+    query = (db.session.query(ResumenMantenimiento, Clase.nombre)
+             .join(Clase, Clase.id == ResumenMantenimiento.clase_id)
+             .order_by(ResumenMantenimiento.mes_programado, ResumenMantenimiento.area, Clase.nombre))
+    if mes:
+        query = query.filter(ResumenMantenimiento.mes_programado == mes)
+    if area:
+        query = query.filter(ResumenMantenimiento.area == area)
+    if clase_id:
+        query = query.filter(ResumenMantenimiento.clase_id == clase_id)
+
+    filas = {}
+    totales = {"programado": 0, "realizado": 0, "cancelado": 0, "total": 0}
+    for resumen, nombre_clase in query:
+        fila = filas.setdefault((resumen.mes_programado, resumen.area, resumen.clase_id), {
+            "mes": resumen.mes_programado, "nombre_mes": MESES.get(resumen.mes_programado),
+            "area": resumen.area, "clase_id": resumen.clase_id, "clase": nombre_clase,
+            "programado": 0, "realizado": 0, "cancelado": 0, "total": 0,
+        })
+        for destino in (fila, totales):
+            destino["total"] += resumen.total
+            if resumen.estado in ESTADOS:
+                destino[resumen.estado.lower()] += resumen.total
+
+    filas = list(filas.values())
+    for fila in filas + [totales]:
+        # Cumplimiento = realizados sobre lo que sigue vigente (sin contar los cancelados).
+        vigentes = fila["total"] - fila["cancelado"]
+        fila["cumplimiento"] = round(100 * fila["realizado"] / vigentes, 1) if vigentes else None
+    return filas, totales
+
+@bp.route('/dashboard')
+def dashboard():
+    mes = request.args.get('mes', type=int)
+    area = request.args.get('area', type=str)
+    clase_id = request.args.get('clase_id', type=int)
+    filas, totales = resumen_cumplimiento(mes, area, clase_id)
+    return render_template(
+        "dashboard.html", filas=filas, totales=totales, meses=MESES, areas=AREAS,
+        clases=Clase.query.order_by(Clase.nombre).all(),
+        mes_seleccionado=mes, area_seleccionada=area, clase_seleccionada=clase_id,
+    )
+
+@bp.route('/dashboard/datos')
+def dashboard_datos():
+    filas, totales = resumen_cumplimiento(
+        request.args.get('mes', type=int), request.args.get('area', type=str), request.args.get('clase_id', type=int)
+    )
+    return jsonify({"filas": filas, "totales": totales})
+
+
+# --- API JSON v1 (SINCRONIZACIÓN DESDE TABLETS) ---
+# Pensada para conexiones malas: se escriben lotes completos en una sola
+# transacción, se suben evidencias de varios mantenimientos en una petición y
+# las lecturas devuelven solo los campos pedidos y solo lo cambiado desde la
+# última sincronización (parámetro 'desde' o cabecera If-Modified-Since).
+
+CAMPOS_API = ('id', 'area', 'locacion', 'tipo_mantenimiento', 'descripcion_activo', 'codigo_mantenimiento',
+              'clase_id', 'mes_programado', 'fecha_realizacion', 'estado', 'autor', 'supervisor',
+              'detalle_mantenimiento_usuario', 'detalle_mantenimiento_sistema', 'informacion_estructurada',
+              'nombre_archivo_reporte', 'actualizado_en', 'evidencias')
+CAMPOS_API_ESCRITURA = ('area', 'locacion', 'tipo_mantenimiento', 'descripcion_activo', 'codigo_mantenimiento',
+                        'clase_id', 'mes_programado', 'fecha_realizacion', 'estado', 'autor', 'supervisor',
+                        'detalle_mantenimiento_usuario', 'detalle_mantenimiento_sistema', 'informacion_estructurada')
+CAMPOS_API_OBLIGATORIOS = ('area', 'locacion', 'tipo_mantenimiento', 'descripcion_activo', 'codigo_mantenimiento',
+                           'clase_id', 'mes_programado')
+
+def _campos_solicitados():
+    """Lee ?campos=a,b,c. Devuelve (campos, error); 'id' siempre se incluye."""
+    texto = request.args.get('campos')
+    if not texto:
+        return CAMPOS_API, None
+    campos = [c.strip() for c in texto.split(',') if c.strip()]
+    desconocidos = [c for c in campos if c not in CAMPOS_API]
+    if desconocidos:
+        return None, f"Campos desconocidos: {', '.join(desconocidos)}."
+    return tuple(dict.fromkeys(['id'] + campos)), None
+
+def _opciones_carga_api(campos):
+    """Carga solo las columnas pedidas, y las evidencias en una consulta aparte si se piden."""
+    columnas = [getattr(Mantenimiento, c) for c in campos if c != 'evidencias']
+    opciones = [db.load_only(*columnas)]
+    if 'evidencias' in campos:
+        opciones.append(db.selectinload(Mantenimiento.evidencias))
+    return opciones
+
+def _mantenimiento_a_json(mant, campos):
+    datos = {}
+    for campo in campos:
+        if campo == 'evidencias':
+            datos[campo] = [
+                {"id": e.id, "nombre_archivo": e.nombre_archivo, "url": url_for('principal.uploaded_file', filename=e.nombre_archivo)}
+                for e in mant.evidencias
+            ]
+        else:
+            valor = getattr(mant, campo)
+            datos[campo] = valor.isoformat() if isinstance(valor, (date, datetime)) else valor
+    return datos
+
+def _instante_desde():
+    """Instante (UTC sin zona) a partir del cual sincronizar, o None. Lanza ValueError si 'desde' no es válido."""
+    if request.args.get('desde'):
+        instante = datetime.fromisoformat(request.args['desde'])
+        if instante.tzinfo:
+            instante = instante.astimezone(timezone.utc).replace(tzinfo=None)
+        return instante
+    if request.if_modified_since:
+        return request.if_modified_since.astimezone(timezone.utc).replace(tzinfo=None)
+    return None
+
+def _validar_mantenimiento_api(datos, clases, creando):
+    """Devuelve (valores, error) con los campos escribibles ya convertidos a su tipo."""
+    desconocidos = [c for c in datos if c not in CAMPOS_API_ESCRITURA and c != 'id']
+    if desconocidos:
+        return None, f"Campos no admitidos: {', '.join(desconocidos)}."
+    valores = {c: datos[c] for c in CAMPOS_API_ESCRITURA if c in datos}
+    if creando:
+        faltan = [c for c in CAMPOS_API_OBLIGATORIOS if valores.get(c) in (None, '')]
+        if faltan:
+            return None, f"Faltan campos obligatorios: {', '.join(faltan)}."
+        valores.setdefault('estado', 'Programado')
+    for campo, valor in valores.items():
+        if campo not in ('clase_id', 'mes_programado') and valor is not None and not isinstance(valor, str):
+            return None, f"'{campo}' debe ser texto."
+    if 'mes_programado' in valores and (type(valores['mes_programado']) is not int or not 1 <= valores['mes_programado'] <= 12):
+        return None, "'mes_programado' debe ser un entero entre 1 y 12."
+    if 'clase_id' in valores and valores['clase_id'] not in clases:
+        return None, f"Clase inexistente: {valores['clase_id']!r}."
+    if 'estado' in valores and valores['estado'] not in ESTADOS:
+        return None, f"Estado no válido: {valores['estado']!r}."
+    if valores.get('fecha_realizacion'):
+        try:
+            valores['fecha_realizacion'] = date.fromisoformat(valores['fecha_realizacion'])
+        except ValueError:
+            return None, "'fecha_realizacion' debe tener el formato AAAA-MM-DD."
+    elif 'fecha_realizacion' in valores:
+        valores['fecha_realizacion'] = None
+    return valores, None
+
+@bp.route('/api/v1/mantenimientos')
+def api_listar_mantenimientos():
+    campos, error = _campos_solicitados()
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        desde = _instante_desde()
+    except ValueError:
+        return jsonify({"error": "'desde' debe ser una fecha ISO 8601."}), 400
+    limite = min(max(request.args.get('limite', current_app.config['API_MAX_LOTE'], type=int), 1), current_app.config['API_MAX_LOTE'])
+    despues_id = request.args.get('despues_id', type=int)
+
+    # Se toma antes de consultar y con margen: lo que se guarde durante la consulta, o se confirme
+    # después con una marca anterior, entra en la próxima sincronización (quizá repetido; el upsert
+    # del cliente es idempotente).
+    sincronizado_en = _ahora_utc() - timedelta(seconds=current_app.config['API_MARGEN_SINCRONIZACION'])
+    query = Mantenimiento.query.options(*_opciones_carga_api(campos)).order_by(Mantenimiento.id)
+    if request.args.get('mes', type=int):
+        query = query.filter(Mantenimiento.mes_programado == request.args.get('mes', type=int))
+    if request.args.get('area'):
+        query = query.filter(Mantenimiento.area == request.args['area'])
+    if desde:
+        query = query.filter(Mantenimiento.actualizado_en >= desde)
+    if despues_id:
+        query = query.filter(Mantenimiento.id > despues_id)
+    filas = query.limit(limite + 1).all()
+
+    eliminados = []
+    if desde and not despues_id:
+        eliminados = [id for (id,) in db.session.query(MantenimientoEliminado.id)
+                      .filter(MantenimientoEliminado.eliminado_en >= desde).order_by(MantenimientoEliminado.id)]
+    if request.if_modified_since and not request.args.get('desde') and not despues_id and not filas and not eliminados:
+        return Response(status=304)
+
+    siguiente_url = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        argumentos = {k: v for k, v in request.args.items() if k != 'despues_id'}
+        siguiente_url = url_for('principal.api_listar_mantenimientos', **argumentos, despues_id=filas[-1].id)
+    respuesta = jsonify({
+        "mantenimientos": [_mantenimiento_a_json(m, campos) for m in filas],
+        "eliminados": eliminados,
+        "sincronizado_en": sincronizado_en.isoformat(),
+        "siguiente_url": siguiente_url,
+    })
+    respuesta.last_modified = sincronizado_en.replace(tzinfo=timezone.utc)
+    respuesta.cache_control.no_cache = True
+    return respuesta
+
+@bp.route('/api/v1/mantenimientos/<int:id>')
+def api_obtener_mantenimiento(id):
+    campos, error = _campos_solicitados()
+    if error:
+        return jsonify({"error": error}), 400
+    mant = Mantenimiento.query.options(*_opciones_carga_api(tuple(campos) + ('actualizado_en',))).filter_by(id=id).first()
+    if not mant:
+        return jsonify({"error": f"Mantenimiento #{id} no encontrado."}), 404
+    respuesta = jsonify(_mantenimiento_a_json(mant, campos))
+    if mant.actualizado_en:
+        respuesta.last_modified = mant.actualizado_en.replace(tzinfo=timezone.utc)
+    respuesta.cache_control.no_cache = True
+    return respuesta.make_conditional(request)
+
+@bp.route('/api/v1/mantenimientos', methods=['POST'])
+def api_guardar_mantenimientos():
+    """Crea o actualiza un lote de mantenimientos en una sola transacción: o se guardan todos o ninguno.
+
+    Cada elemento se actualiza por 'id' o, si no lo trae, por 'codigo_mantenimiento'; así
+    reenviar un lote tras un corte de conexión no duplica registros.
+    """
+    cuerpo = request.get_json(silent=True)
+    elementos = cuerpo.get('mantenimientos') if isinstance(cuerpo, dict) else cuerpo
+    if not isinstance(elementos, list) or not elementos:
+        return jsonify({"error": "Se esperaba una lista de mantenimientos."}), 400
+    if len(elementos) > current_app.config['API_MAX_LOTE']:
+        return jsonify({"error": f"El lote supera el máximo de {current_app.config['API_MAX_LOTE']} mantenimientos."}), 413
+    if not all(isinstance(datos, dict) for datos in elementos):
+        return jsonify({"error": "Cada mantenimiento debe ser un objeto JSON."}), 400
+
+    # Todos los existentes del lote se buscan con dos consultas, no una por elemento.
+    clases = {id for (id,) in db.session.query(Clase.id)}
+    ids = {d['id'] for d in elementos if type(d.get('id')) is int}
+    por_id = {m.id: m for m in Mantenimiento.query.filter(Mantenimiento.id.in_(ids))} if ids else {}
+    codigos = {d['codigo_mantenimiento'] for d in elementos
+               if d.get('id') is None and isinstance(d.get('codigo_mantenimiento'), str)}
+    por_codigo = {}
+    if codigos:
+        for m in Mantenimiento.query.filter(Mantenimiento.codigo_mantenimiento.in_(codigos)).order_by(Mantenimiento.id):
+            por_codigo.setdefault(m.codigo_mantenimiento, m)
+
+    errores, guardados, cambios_resumen = [], [], Counter()
+    for indice, datos in enumerate(elementos):
+        if datos.get('id') is not None:
+            mant = por_id.get(datos['id'])
+            if mant is None:
+                errores.append({"indice": indice, "error": f"Mantenimiento #{datos['id']} no encontrado."})
+                continue
+        else:
+            mant = por_codigo.get(datos.get('codigo_mantenimiento'))
+        valores, error = _validar_mantenimiento_api(datos, clases, creando=mant is None)
+        if error:
+            errores.append({"indice": indice, "error": error})
+            continue
+        creado = mant is None
+        if creado:
+            mant = Mantenimiento(**valores)
+            db.session.add(mant)
+            por_codigo[mant.codigo_mantenimiento] = mant
+        else:
+            cambios_resumen[clave_resumen(mant)] -= 1
+            for campo, valor in valores.items():
+                setattr(mant, campo, valor)
+        cambios_resumen[clave_resumen(mant)] += 1
+        guardados.append((indice, mant, creado))
+
+    if errores:
+        db.session.rollback()
+        return jsonify({"error": "El lote no se guardó: hay elementos con errores.", "errores": errores}), 400
+
+    db.session.flush()
+    ajustar_resumen(cambios_resumen)
+    db.session.commit()
+    return jsonify({"resultados": [
+        {"indice": indice, "id": mant.id, "codigo_mantenimiento": mant.codigo_mantenimiento, "creado": creado,
+         "actualizado_en": mant.actualizado_en.isoformat() if mant.actualizado_en else None}
+        for indice, mant, creado in guardados
+    ]})
+
+@bp.route('/api/v1/evidencias', methods=['POST'])
+def api_subir_evidencias():
+    """Sube evidencias de varios mantenimientos a la vez.
+
+    Cada archivo va en un campo multipart llamado 'mantenimiento-<id>' (se admiten varios por campo).
+    """
+    archivos_por_mant = {}
+    for campo in request.files.keys():
+        prefijo, _, id_str = campo.partition('-')
+        if prefijo != 'mantenimiento' or not id_str.isdigit():
+            return jsonify({"error": f"Campo no válido: '{campo}'. Usa 'mantenimiento-<id>'."}), 400
+        archivos = [a for a in request.files.getlist(campo) if a.filename]
+        if archivos:
+            archivos_por_mant.setdefault(int(id_str), []).extend(archivos)
+    if not archivos_por_mant:
+        return jsonify({"error": "No se recibió ningún archivo."}), 400
+
+    mantenimientos = {m.id: m for m in Mantenimiento.query.options(db.selectinload(Mantenimiento.evidencias))
+                      .filter(Mantenimiento.id.in_(archivos_por_mant))}
+    faltantes = sorted(set(archivos_por_mant) - set(mantenimientos))
+    if faltantes:
+        return jsonify({"error": f"Mantenimientos no encontrados: {', '.join(map(str, faltantes))}."}), 404
+
+    ahora = _ahora_utc()
+    for id, archivos in archivos_por_mant.items():
+        mant = mantenimientos[id]
+        ya_adjuntas = {e.nombre_archivo for e in mant.evidencias}
+        for archivo in archivos:
+            nombre = guardar_evidencia_subida(archivo)
+            if nombre in ya_adjuntas:
+                continue
+            ya_adjuntas.add(nombre)
+            mant.evidencias.append(Evidencia(nombre_archivo=nombre))
+        mant.actualizado_en = ahora
+    db.session.commit()
+
+    return jsonify({"mantenimientos": [
+        _mantenimiento_a_json(mantenimientos[id], ('id', 'actualizado_en', 'evidencias')) for id in archivos_por_mant
+    ]}), 201
+
+
 # --- COMANDOS CLI PARA INICIALIZAR LA BD ---
-@app.cli.command("init-db")
+def _asegurar_columnas():
+    """Agrega a las tablas existentes las columnas nuevas del modelo (create_all no altera tablas)."""
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as conexion:
+        for tabla in db.metadata.sorted_tables:
+            if not inspector.has_table(tabla.name):
+                continue
+            existentes = {c['name'] for c in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name not in existentes:
+                    tipo = columna.type.compile(dialect=db.engine.dialect)
+                    conexion.exec_driver_sql(f'ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}')
+
+def _asegurar_indices():
+    """Crea los índices declarados que falten en tablas ya existentes (create_all solo los crea con la tabla)."""
+    for tabla in db.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            indice.create(bind=db.engine, checkfirst=True)
+
+@bp.cli.command("init-db")
 def init_db_command():
     """Crea las tablas de la base de datos y datos iniciales."""
-    with app.app_context():
-        db.create_all()
-        if not Clase.query.first():
-            clases_iniciales = [
-                "EQUIPOS EN BATERÍAS", "MOTORES DE GAS", "UNIDAD DE BOMBEO MECANICO", "EQUIPOS PL GL",
-                "GENERACIÓN ELÉCTRICA", "GASODUCTO", "TANQUES", "SISTEMA DE PAT",
-                "TANQUE DE FISCALIZACIÓN", "PLANTA DE INYECCIÓN DE AGUA"
-            ]
-            for nombre_clase in clases_iniciales:
-                db.session.add(Clase(nombre=nombre_clase))
-            db.session.commit()
-        print("Base de datos inicializada.")
+    db.create_all()
+    _asegurar_columnas()
+    _asegurar_indices()
+    _asegurar_busqueda()
+    # Las filas anteriores a la columna actualizado_en entran en la próxima sincronización.
+    Mantenimiento.query.filter(Mantenimiento.actualizado_en.is_(None)).update(
+        {Mantenimiento.actualizado_en: _ahora_utc()}, synchronize_session=False)
+    db.session.commit()
+    if Mantenimiento.query.first() and not ResumenMantenimiento.query.first():
+        reconstruir_resumen()
+    if not Clase.query.first():
+        clases_iniciales = [
+            "EQUIPOS EN BATERÍAS", "MOTORES DE GAS", "UNIDAD DE BOMBEO MECANICO", "EQUIPOS PL GL",
+            "GENERACIÓN ELÉCTRICA", "GASODUCTO", "TANQUES", "SISTEMA DE PAT",
+            "TANQUE DE FISCALIZACIÓN", "PLANTA DE INYECCIÓN DE AGUA"
+        ]
+        for nombre_clase in clases_iniciales:
+            db.session.add(Clase(nombre=nombre_clase))
+        db.session.commit()
+    print("Base de datos inicializada.")
+
+@bp.cli.command("reconstruir-resumen")
+def reconstruir_resumen_command():
+    """Recalcula desde cero la tabla resumen del panel de cumplimiento."""
+    reconstruir_resumen()
+    print(f"Resumen reconstruido: {ResumenMantenimiento.query.count()} combinaciones.")
+
+@bp.cli.command("procesar-evidencias")
+def procesar_evidencias_command():
+    """Genera las variantes (reporte y miniatura) de las evidencias que aún no las tienen."""
+    procesadas = 0
+    for evidencia in Evidencia.query.yield_per(500):
+        if archivo_evidencia(evidencia.nombre_archivo, 'mini') == evidencia.nombre_archivo:
+            if generar_variantes_evidencia(evidencia.nombre_archivo):
+                procesadas += 1
+    print(f"Variantes generadas para {procesadas} evidencias.")
+
+@bp.cli.command("exportar-reportes")
+@click.option("--mes", type=int, default=None, help="Mes programado (1-12).")
+@click.option("--area", default=None, help="Área, por ejemplo Mecánica.")
+@click.option("--salida", default=None, help="Ruta del ZIP a escribir (por defecto, en la carpeta actual).")
+def exportar_reportes_command(mes, area, salida):
+    """Exporta a un ZIP los reportes Word de los mantenimientos filtrados, generando los que falten."""
+    salida = salida or nombre_zip_reportes(mes, area)
+    mantenimientos = consulta_mantenimientos(mes, area).options(db.selectinload(Mantenimiento.evidencias)).all()
+    with open(salida, "wb") as f:
+        for bloque in generar_zip_reportes(mantenimientos):
+            f.write(bloque)
+    print(f"Exportados {len(mantenimientos)} mantenimientos en {salida}.")
+
+@bp.cli.command("importar-plan")
+@click.argument("archivo", type=click.Path(exists=True, dir_okay=False))
+@click.option("--area", default=None, help="Área a usar en las filas que no la indiquen.")
+@click.option("--tamano-lote", default=1000, show_default=True, help="Filas por inserción.")
+def importar_plan_command(archivo, area, tamano_lote):
+    """Importa el plan anual de mantenimientos desde un CSV o XLSX."""
+    with open(archivo, "rb") as f:
+        try:
+            resultado = importar_plan(leer_plan(f, archivo), area_por_defecto=area, tamano_lote=tamano_lote)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            db.session.rollback()
+            raise click.ClickException(str(e))
+    for numero, mensaje in resultado["errores"]:
+        print(f"Fila {numero}: {mensaje}")
+    print(f"Creados: {resultado['insertadas']}. Ya existían: {resultado['existentes']}. "
+          f"Filas con errores: {resultado['total_errores']}.")
+
+@bp.cli.command("migrar-evidencias")
+def migrar_evidencias_command():
+    """Renombra las evidencias existentes a su hash de contenido y fusiona los duplicados."""
+    carpeta = current_app.config['UPLOAD_FOLDER']
+    nombres = [n for (n,) in db.session.query(Evidencia.nombre_archivo).distinct()
+               if not _PATRON_NOMBRE_CONTENIDO.match(n)]
+    migradas, fusionadas, faltantes = 0, 0, []
+    for nombre in nombres:
+        ruta = os.path.join(carpeta, nombre)
+        if not os.path.exists(ruta):
+            faltantes.append(nombre)
+            continue
+        nuevo = f"{_hash_archivo(ruta)}{_extension_blob(nombre)}"
+        if os.path.exists(os.path.join(carpeta, nuevo)):
+            os.remove(ruta)
+            eliminar_variantes_evidencia(nombre)
+            fusionadas += 1
+        else:
+            os.replace(ruta, os.path.join(carpeta, nuevo))
+            for variante in VARIANTES_EVIDENCIA:
+                ruta_variante = os.path.join(carpeta, nombre_variante(nombre, variante))
+                if os.path.exists(ruta_variante):
+                    os.replace(ruta_variante, os.path.join(carpeta, nombre_variante(nuevo, variante)))
+            migradas += 1
+        # Los clientes de la sincronización incremental deben recibir la nueva ruta.
+        Mantenimiento.query.filter(Mantenimiento.id.in_(
+            db.session.query(Evidencia.mantenimiento_id).filter_by(nombre_archivo=nombre)
+        )).update({Mantenimiento.actualizado_en: _ahora_utc()}, synchronize_session=False)
+        Evidencia.query.filter_by(nombre_archivo=nombre).update({"nombre_archivo": nuevo})
+        db.session.commit()
+    for nombre in faltantes:
+        print(f"Archivo no encontrado: {nombre}")
+    print(f"Migradas: {migradas}. Duplicados fusionados: {fusionadas}. Faltantes: {len(faltantes)}.")
+
+@bp.cli.command("eliminar-mantenimientos")
+@click.option("--mes", type=int, default=None, help="Mes programado (1-12).")
+@click.option("--area", default=None, help="Área, por ejemplo Mecánica.")
+@click.option("--id", "ids", type=int, multiple=True, help="Id a eliminar (se puede repetir).")
+@click.confirmation_option(prompt="¿Eliminar los mantenimientos seleccionados y sus evidencias?")
+def eliminar_mantenimientos_command(mes, area, ids):
+    """Elimina en bloque mantenimientos por id o por filtros de mes/área."""
+    if not ids and not mes and not area:
+        raise click.ClickException("Indica --id, --mes o --area.")
+    if not ids:
+        ids = [id for (id,) in consulta_mantenimientos(mes, area).order_by(None).with_entities(Mantenimiento.id)]
+    eliminados = eliminar_mantenimientos(ids)
+    limpiador_archivos.esperar()
+    print(f"Mantenimientos eliminados: {eliminados}.")
+
+@bp.cli.command("limpiar-archivos")
+@click.option("--lote", default=500, show_default=True, help="Archivos que se borran por lote.")
+@click.option("--min-edad", default=3600, show_default=True, help="Antigüedad mínima, en segundos, de un archivo para borrarlo.")
+@click.option("--simular", is_flag=True, help="Solo lista los archivos huérfanos, sin borrarlos.")
+def limpiar_archivos_command(lote, min_edad, simular):
+    """Borra de uploads/ y generated_reports/ los archivos que la base de datos ya no referencia.
+
+    Los archivos recientes se respetan para no borrar subidas cuyo commit aún no terminó.
+    """
+    evidencias = {n for (n,) in db.session.query(Evidencia.nombre_archivo).distinct().yield_per(5000)}
+    reportes = {n for (n,) in db.session.query(Mantenimiento.nombre_archivo_reporte)
+                .filter(Mantenimiento.nombre_archivo_reporte.isnot(None)).yield_per(5000)}
+    bases_evidencias = {os.path.splitext(n)[0] for n in evidencias}
+    patron_variante = re.compile(r'^(.*)_(%s)\.jpg$' % '|'.join(VARIANTES_EVIDENCIA))
+    limite = time.time() - min_edad
+
+    def huerfanos(carpeta, referenciado):
+        with os.scandir(carpeta) as entradas:
+            for entrada in entradas:
+                if not entrada.is_file() or entrada.name in ('.gitkeep', '.bloqueo') or referenciado(entrada.name):
+                    continue
+                if entrada.stat().st_mtime < limite:
+                    yield entrada.path
+
+    def es_evidencia(nombre):
+        variante = patron_variante.match(nombre)
+        return nombre in evidencias or bool(variante and variante.group(1) in bases_evidencias)
+
+    total = 0
+    for carpeta, referenciado in ((current_app.config['UPLOAD_FOLDER'], es_evidencia),
+                                  (current_app.config['GENERATED_REPORTS_FOLDER'], reportes.__contains__)):
+        for grupo in itertools.batched(huerfanos(carpeta, referenciado), lote):
+            if simular:
+                for ruta in grupo:
+                    print(ruta)
+            else:
+                # Una subida que reutiliza el blob renueva su fecha bajo el mismo bloqueo.
+                with _bloqueo_blobs():
+                    for ruta in grupo:
+                        if not _modificado_despues(ruta, limite):
+                            _eliminar_archivo(os.path.dirname(ruta), os.path.basename(ruta))
+            total += len(grupo)
+            if not simular:
+                print(f"{carpeta}: {total} archivos huérfanos borrados hasta ahora...")
+    print(f"Archivos huérfanos {'encontrados' if simular else 'borrados'}: {total}.")
+
+@bp.cli.command("verificar-evidencias")
+def verificar_evidencias_command():
+    """Comprueba que el contenido de cada evidencia coincide con el hash de su nombre."""
+    corruptas = 0
+    for (nombre,) in db.session.query(Evidencia.nombre_archivo).distinct():
+        if not _PATRON_NOMBRE_CONTENIDO.match(nombre):
+            continue
+        ruta = os.path.join(current_app.config['UPLOAD_FOLDER'], nombre)
+        if not os.path.exists(ruta) or _hash_archivo(ruta) != nombre[:64]:
+            print(f"Evidencia ausente o corrupta: {nombre}")
+            corruptas += 1
+    print(f"Evidencias con problemas: {corruptas}.")
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
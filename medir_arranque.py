@@ -0,0 +1,209 @@
+"""Mide el tiempo de arranque y la memoria de main.py con varios workers.
+
+Reproduce lo que hace gunicorn con y sin --preload: en "preload" el proceso
+maestro importa main y ejecuta create_app() antes de crear los workers con
+fork (comparten esas páginas de memoria); en "sin-preload" cada worker hace
+su propio arranque tras el fork. Cada modo se mide en un proceso Python nuevo
+para que nada quede importado de antes:
+
+    python medir_arranque.py --workers 4 --salida arranque.json
+    python medir_arranque.py --workers 4 --cargar ia,reportes,imagenes
+
+Con --cargar cada worker importa además esos subsistemas, como ocurriría en
+su primera petición que los usa. La memoria se toma de /proc (VmRSS y la PSS
+de smaps_rollup, que reparte las páginas compartidas entre los procesos), así
+que los números de memoria solo están disponibles en Linux.
+"""
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+MODOS = ("preload", "sin-preload")
+SUBSISTEMAS = ("ia", "reportes", "imagenes")
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4, help="Workers que se crean con fork.")
+    parser.add_argument("--modos", default=",".join(MODOS), help=f"Lista separada por comas de: {', '.join(MODOS)}.")
+    parser.add_argument("--cargar", default="", help=f"Subsistemas que cada worker importa tras arrancar: {', '.join(SUBSISTEMAS)}.")
+    parser.add_argument("--db-url", default=None, help="URL de SQLAlchemy; por defecto, la de DATABASE_URL o .env (no se conecta).")
+    parser.add_argument("--salida", default=None, help="Archivo JSON de resultados (por defecto, la salida estándar).")
+    parser.add_argument("--hijo", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def _lista(texto):
+    return [parte.strip() for parte in texto.split(",") if parte.strip()]
+
+
+def _memoria():
+    """RSS y PSS del proceso actual, en MB (None si no hay /proc)."""
+    datos = {"rss_mb": None, "pss_mb": None}
+    for archivo, clave, campo in (("/proc/self/status", "VmRSS:", "rss_mb"), ("/proc/self/smaps_rollup", "Pss:", "pss_mb")):
+        try:
+            with open(archivo) as f:
+                for linea in f:
+                    if linea.startswith(clave):
+                        datos[campo] = round(int(linea.split()[1]) / 1024, 1)
+                        break
+        except OSError:
+            pass
+    return datos
+
+
+def _arrancar():
+    """Importa main y crea la aplicación, como hace un worker de gunicorn."""
+    inicio = time.perf_counter()
+    main = importlib.import_module("main")
+    importado = time.perf_counter()
+    main.create_app()
+    creado = time.perf_counter()
+    return main, {
+        "importar_s": round(importado - inicio, 4),
+        "create_app_s": round(creado - importado, 4),
+        "modulos": len(sys.modules),
+        "subsistemas_cargados": _subsistemas_cargados(main),
+    }
+
+
+def _subsistemas_cargados(main):
+    return [nombre for nombre, modulos in main.SUBSISTEMAS_PEREZOSOS.items()
+            if all(modulo in sys.modules for modulo in modulos)]
+
+
+def _cargar(main, subsistemas):
+    inicio = time.perf_counter()
+    for nombre in subsistemas:
+        for modulo in main.SUBSISTEMAS_PEREZOSOS[nombre]:
+            importlib.import_module(modulo)
+    return round(time.perf_counter() - inicio, 4)
+
+
+def _worker(modo, main, subsistemas, escritura, puerta):
+    """Cuerpo de cada worker tras el fork: arranca, avisa y espera a la señal para medir la memoria."""
+    inicio = time.perf_counter()
+    try:
+        if modo == "preload":
+            datos = {"subsistemas_cargados": _subsistemas_cargados(main)}
+        else:
+            main, datos = _arrancar()
+        if subsistemas:
+            datos["cargar_s"] = _cargar(main, subsistemas)
+        datos["listo_s"] = round(time.perf_counter() - inicio, 4)
+    except BaseException as e:
+        datos = {"error": repr(e)}
+    os.write(escritura, b"listo\n")
+    # La PSS depende de cuántos procesos comparten cada página: se mide con todos vivos.
+    os.read(puerta, 1)
+    datos.update(_memoria())
+    os.write(escritura, (json.dumps(datos) + "\n").encode())
+    os._exit(0)
+
+
+def _medir_modo(modo, workers, subsistemas):
+    inicio = time.perf_counter()
+    maestro = {}
+    main = None
+    if modo == "preload":
+        main, maestro = _arrancar()
+        maestro.update(_memoria())
+
+    lectura, escritura = os.pipe()
+    puerta_lectura, puerta_escritura = os.pipe()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(lectura)
+            os.close(puerta_escritura)
+            _worker(modo, main, subsistemas, escritura, puerta_lectura)
+        pids.append(pid)
+    os.close(escritura)
+    os.close(puerta_lectura)
+
+    with os.fdopen(lectura) as resultados:
+        for _ in range(workers):
+            resultados.readline()
+        todos_listos = time.perf_counter() - inicio
+        os.write(puerta_escritura, b"x" * workers)
+        maestro["memoria_con_workers"] = _memoria()
+        datos_workers = [json.loads(resultados.readline()) for _ in range(workers)]
+    os.close(puerta_escritura)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+    pss = [w["pss_mb"] for w in datos_workers] + [maestro["memoria_con_workers"]["pss_mb"]]
+    return {
+        "todos_listos_s": round(todos_listos, 4),
+        "pss_total_mb": round(sum(pss), 1) if None not in pss else None,
+        "maestro": maestro,
+        "workers": datos_workers,
+    }
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ejecutar():
+    args = _argumentos()
+    subsistemas = _lista(args.cargar)
+    desconocidos = [s for s in subsistemas if s not in SUBSISTEMAS]
+    if desconocidos:
+        sys.exit(f"Subsistemas desconocidos: {', '.join(desconocidos)}")
+
+    if args.hijo:
+        # Proceso nuevo por modo: main todavía no está importado.
+        os.chdir(RAIZ)
+        print(json.dumps(_medir_modo(args.hijo, args.workers, subsistemas)))
+        return
+
+    modos = _lista(args.modos)
+    desconocidos = [m for m in modos if m not in MODOS]
+    if desconocidos:
+        sys.exit(f"Modos desconocidos: {', '.join(desconocidos)}")
+    if not hasattr(os, "fork"):
+        sys.exit("La medición con workers necesita os.fork (Linux o macOS).")
+
+    entorno = dict(os.environ)
+    if args.db_url:
+        entorno["DATABASE_URL"] = args.db_url
+    resultados = {}
+    for modo in modos:
+        proceso = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--hijo", modo, "--workers", str(args.workers), "--cargar", args.cargar],
+            cwd=RAIZ, env=entorno, capture_output=True, text=True,
+        )
+        if proceso.returncode != 0:
+            sys.exit(f"Falló la medición del modo {modo}:\n{proceso.stderr}")
+        resultados[modo] = json.loads(proceso.stdout.strip().splitlines()[-1])
+        print(f"{modo}: workers listos en {resultados[modo]['todos_listos_s']} s, "
+              f"PSS total {resultados[modo]['pss_total_mb']} MB", file=sys.stderr)
+
+    informe = {
+        "commit": _commit_actual(),
+        "python": sys.version.split()[0],
+        "workers": args.workers,
+        "cargar": subsistemas,
+        "modos": resultados,
+    }
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    ejecutar()
@@ -54,6 +54,55 @@ document.addEventListener('DOMContentLoaded', function() {
     // Llamada inicial para establecer el estado correcto al cargar la página
     actualizarEstadoBotonesIA();
 
+    // Mensaje de error de la IA; con 503 el servidor indica en cuántos segundos reintentar.
+    function mensajeErrorIA(result, reintentarEn) {
+        const mensaje = result.error || 'El servicio de IA no está disponible.';
+        return reintentarEn ? `${mensaje} Intenta de nuevo en ${reintentarEn} segundos.` : mensaje;
+    }
+
+    // Llama a una ruta de IA en modo streaming (SSE) e invoca onParcial con cada fragmento de texto.
+    // Devuelve el JSON del evento 'fin' o lanza un Error con el mensaje del servidor.
+    async function generarEnStreaming(url, data, onParcial) {
+        const response = await fetch(url, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(data)
+        });
+        if (!response.ok) {
+            const result = await response.json().catch(() => ({}));
+            if (response.status === 503) {
+                throw new Error(mensajeErrorIA(result, result.reintentar_en || response.headers.get('Retry-After')));
+            }
+            throw new Error(result.error);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let separador;
+            while ((separador = buffer.indexOf('\n\n')) !== -1) {
+                const bloque = buffer.slice(0, separador);
+                buffer = buffer.slice(separador + 2);
+                let evento = 'message';
+                let datos = '';
+                for (const linea of bloque.split('\n')) {
+                    if (linea.startsWith('event:')) evento = linea.slice(6).trim();
+                    else if (linea.startsWith('data:')) datos += linea.slice(5).trim();
+                }
+                const payload = JSON.parse(datos);
+                if (evento === 'parcial') onParcial(payload.texto);
+                else if (evento === 'fin') return payload;
+                else if (evento === 'error') throw new Error(mensajeErrorIA(payload, payload.reintentar_en));
+            }
+        }
+        throw new Error('La conexión se cerró antes de recibir la respuesta completa.');
+    }
+
     // Listener para el botón de generar "Detalle del Sistema"
     if (btnGenerarDetalle) {
         btnGenerarDetalle.addEventListener('click', async function() {
@@ -69,24 +118,18 @@ document.addEventListener('DOMContentLoaded', function() {
                 locacion: document.getElementById('locacion').value
             };
 
+            const valorAnterior = detalleSistemaText.value;
             try {
-                const response = await fetch('/generar/detalle-sistema', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify(data)
+                detalleSistemaText.value = '';
+                const result = await generarEnStreaming('/generar/detalle-sistema/stream', data, texto => {
+                    detalleSistemaText.value += texto;
                 });
-
-                const result = await response.json();
-
-                if (response.ok) {
-                    detalleSistemaText.value = result.detalle;
-                    // Disparar el evento 'input' para que se actualice el estado del otro botón
-                    detalleSistemaText.dispatchEvent(new Event('input'));
-                } else {
-                    alert('Error: ' + result.error);
-                }
+                detalleSistemaText.value = result.detalle;
+                // Disparar el evento 'input' para que se actualice el estado del otro botón
+                detalleSistemaText.dispatchEvent(new Event('input'));
             } catch (error) {
-                alert('Ha ocurrido un error de conexión.');
+                detalleSistemaText.value = valorAnterior;
+                alert('Error: ' + (error.message || 'Ha ocurrido un error de conexión.'));
                 console.error('Error:', error);
             } finally {
                 this.disabled = false;
@@ -111,22 +154,18 @@ document.addEventListener('DOMContentLoaded', function() {
                 detalle_sistema: detalleSistemaText.value
             };
             
+            const infoText = document.getElementById('informacion_estructurada');
+            const valorAnterior = infoText.value;
             try {
-                const response = await fetch('/generar/info-estructurada', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify(data)
+                infoText.value = '';
+                const result = await generarEnStreaming('/generar/info-estructurada/stream', data, texto => {
+                    infoText.value += texto;
                 });
-
-                const result = await response.json();
-
-                if (response.ok) {
-                    document.getElementById('informacion_estructurada').value = result.info;
-                } else {
-                    alert('Error: ' + result.error);
-                }
+                infoText.value = result.info;
+                infoText.dispatchEvent(new Event('input'));
             } catch (error) {
-                alert('Ha ocurrido un error de conexión.');
+                infoText.value = valorAnterior;
+                alert('Error: ' + (error.message || 'Ha ocurrido un error de conexión.'));
                 console.error('Error:', error);
             } finally {
                 this.disabled = false;
@@ -158,7 +197,19 @@ document.addEventListener('DOMContentLoaded', function() {
     // Llamada inicial para establecer el estado correcto
     actualizarEstadoBotonReporte();
 
-    // Nueva función global para generar el reporte Word
+    // Consulta periódicamente el estado de un trabajo de generación hasta que termine
+    async function esperarTrabajoReporte(urlEstado) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            const response = await fetch(urlEstado);
+            const result = await response.json();
+            if (!response.ok || result.estado === 'completado' || result.estado === 'error') {
+                return { ok: response.ok && result.estado === 'completado', result: result };
+            }
+        }
+    }
+
+    // Nueva función global para generar el reporte Word (se encola y se consulta su estado)
     window.generarReporteWord = async function(id) {
         const spinner = btnGenerarReporte.querySelector('.spinner-border');
         btnGenerarReporte.disabled = true;
@@ -168,8 +219,18 @@ document.addEventListener('DOMContentLoaded', function() {
             const response = await fetch(`/generar-reporte-word/${id}`, {
                 method: 'POST'
             });
-            const result = await response.json();
-            if (response.ok) {
+            const encolado = await response.json();
+            if (!response.ok) {
+                alert('Error: ' + encolado.error);
+                btnGenerarReporte.disabled = false;
+                return;
+            }
+
+            // Si el reporte ya estaba al día el servidor responde completado sin encolar.
+            const { ok, result } = encolado.estado === 'completado'
+                ? { ok: true, result: encolado }
+                : await esperarTrabajoReporte(encolado.url_estado);
+            if (ok) {
                 alert(result.message);
                 location.reload(); // Recarga la página para mostrar el botón de descarga
             } else {
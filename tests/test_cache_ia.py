@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+
+import main
+
+TTL = 0.3
+
+
+class CacheRespuestasIATest(unittest.TestCase):
+    """Aciertos, caducidad y peticiones coalescidas de CacheRespuestasIA con el backend simulado."""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.app = main.create_app({
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(self.directorio, 'pruebas.db')}",
+            "UPLOAD_FOLDER": os.path.join(self.directorio, "uploads"),
+            "GENERATED_REPORTS_FOLDER": os.path.join(self.directorio, "generated_reports"),
+            "IA_CACHE_TTL": TTL,
+            "IA_CACHE_MAX_MEMORIA": 2,
+        })
+        self.contexto = self.app.app_context()
+        self.contexto.push()
+        main.db.create_all()
+        self.backend = main.BackendIAFalso()
+        self.cache = main.CacheRespuestasIA()
+
+    def tearDown(self):
+        main.db.session.remove()
+        main.db.engine.dispose()
+        self.contexto.pop()
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def _obtener(self, prompt, cache=None):
+        return (cache or self.cache).obtener(main.GEMINI_MODEL, prompt, lambda: self.backend.generar(prompt))
+
+    def test_aciertos_en_memoria_y_persistentes(self):
+        primera = self._obtener("prompt")
+        self.assertEqual(self._obtener("  prompt  "), primera)  # El prompt se normaliza.
+        self.assertEqual(self.backend.llamadas, 1)
+        self.assertEqual(self.cache.estadisticas()["hits_memoria"], 1)
+
+        # Otro proceso (otra caché, memoria vacía) la encuentra en la tabla RespuestaIA.
+        otra = main.CacheRespuestasIA()
+        self.assertEqual(self._obtener("prompt", otra), primera)
+        self.assertEqual(self.backend.llamadas, 1)
+        self.assertEqual(otra.estadisticas()["hits_persistente"], 1)
+
+    def test_expira_en_se_guarda_en_utc(self):
+        self._obtener("prompt")
+        fila = main.RespuestaIA.query.one()
+        self.assertLess(abs(fila.expira_en - main._ahora_utc() - timedelta(seconds=TTL)), timedelta(seconds=5))
+
+    def test_lru_limita_las_entradas_en_memoria(self):
+        for prompt in ("a", "b", "c"):
+            self._obtener(prompt)
+        self.assertEqual(self.cache.estadisticas()["entradas_memoria"], 2)
+
+    def test_respuesta_caducada_se_vuelve_a_pedir(self):
+        self._obtener("prompt")
+        time.sleep(TTL * 2)
+        self._obtener("prompt")
+        self.assertEqual(self.backend.llamadas, 2)
+        self.assertEqual(self.cache.estadisticas()["misses"], 2)
+
+    def test_peticiones_identicas_simultaneas_se_coalescen(self):
+        self.backend.latencia = 0.3
+        resultados = []
+
+        def pedir():
+            with self.app.app_context():
+                resultados.append(self._obtener("prompt"))
+                main.db.session.remove()
+
+        hilos = [threading.Thread(target=pedir) for _ in range(4)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(self.backend.llamadas, 1)
+        self.assertEqual(len(set(resultados)), 1)
+        self.assertEqual(len(resultados), 4)
+        self.assertEqual(self.cache.estadisticas()["coalescidas"], 3)
+        self.assertEqual(self.cache._en_vuelo, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import main
+
+ENFRIAMIENTO = 0.05
+
+
+class CortacircuitosIATest(unittest.TestCase):
+    """Estados del cortacircuitos de ClienteIA con el backend simulado."""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.app = main.create_app({
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "UPLOAD_FOLDER": os.path.join(self.directorio, "uploads"),
+            "GENERATED_REPORTS_FOLDER": os.path.join(self.directorio, "generated_reports"),
+            "IA_REINTENTOS": 0,
+            "IA_ESPERA_CUPO": 0.1,
+            "IA_CIRCUITO_FALLOS": 3,
+            "IA_CIRCUITO_ENFRIAMIENTO": ENFRIAMIENTO,
+        })
+        self.contexto = self.app.app_context()
+        self.contexto.push()
+        self.backend = main.BackendIAFalso(tasa_fallos=1.0)
+        self.cliente = main.ClienteIA(self.backend)
+
+    def tearDown(self):
+        self.contexto.pop()
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def _abrir_circuito(self):
+        for _ in range(3):
+            with self.assertRaises(main.IANoDisponible):
+                self.cliente.generar("prompt")
+
+    def _esperar_enfriamiento(self):
+        time.sleep(ENFRIAMIENTO * 2)
+        self.backend.tasa_fallos = 0.0
+
+    def test_se_abre_tras_n_fallos_seguidos(self):
+        self._abrir_circuito()
+        self.assertEqual(self.cliente.estado()["circuito"], "abierto")
+        self.assertFalse(self.cliente.disponible())
+        with self.assertRaisesRegex(main.IANoDisponible, "temporalmente"):
+            self.cliente.generar("prompt")
+        self.assertEqual(self.backend.llamadas, 3)
+        self.assertEqual(self.cliente.estado()["rechazadas_circuito"], 1)
+
+    def test_semiabierto_deja_pasar_una_sola_prueba(self):
+        self._abrir_circuito()
+        self._esperar_enfriamiento()
+        self.assertEqual(self.cliente.estado()["circuito"], "semiabierto")
+        prueba = self.cliente.generar_stream("prompt")
+        next(prueba)
+        with self.assertRaisesRegex(main.IANoDisponible, "temporalmente"):
+            self.cliente.generar("prompt")
+        self.assertEqual(self.backend.llamadas, 4)
+        self.assertTrue("".join(prueba))
+        self.assertEqual(self.cliente.estado()["circuito"], "cerrado")
+
+    def test_prueba_exitosa_cierra_el_circuito(self):
+        self._abrir_circuito()
+        self._esperar_enfriamiento()
+        self.assertTrue(self.cliente.generar("prompt"))
+        estado = self.cliente.estado()
+        self.assertEqual(estado["circuito"], "cerrado")
+        self.assertEqual(estado["fallos_seguidos"], 0)
+        self.assertTrue(self.cliente.disponible())
+
+    def test_prueba_fallida_vuelve_a_abrir(self):
+        self._abrir_circuito()
+        time.sleep(ENFRIAMIENTO * 2)
+        with self.assertRaises(main.IANoDisponible):
+            self.cliente.generar("prompt")
+        self.assertEqual(self.cliente.estado()["circuito"], "abierto")
+
+    def test_stream_de_prueba_abandonado_libera_la_prueba(self):
+        self._abrir_circuito()
+        self._esperar_enfriamiento()
+        prueba = self.cliente.generar_stream("prompt")
+        next(prueba)
+        prueba.close()  # El navegador se desconecta: GeneratorExit en el yield.
+        self.assertTrue(self.cliente.disponible())
+        self.assertTrue(self.cliente.generar("prompt"))
+        self.assertEqual(self.cliente.estado()["circuito"], "cerrado")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from openpyxl import Workbook
+
+import main
+
+
+def _xlsx_valido():
+    libro = Workbook()
+    libro.active.append(list(main.COLUMNAS_OBLIGATORIAS))
+    salida = io.BytesIO()
+    libro.save(salida)
+    return salida.getvalue()
+
+
+class ImportarXlsxDanadoTest(unittest.TestCase):
+    """Un .xlsx dañado debe rechazarse con un mensaje, no con un error 500."""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.app = main.create_app({
+            "TESTING": True,
+            "SECRET_KEY": "pruebas",
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(self.directorio, 'pruebas.db')}",
+            "UPLOAD_FOLDER": os.path.join(self.directorio, "uploads"),
+            "GENERATED_REPORTS_FOLDER": os.path.join(self.directorio, "generated_reports"),
+        })
+        with self.app.app_context():
+            main.db.create_all()
+
+    def tearDown(self):
+        with self.app.app_context():
+            main.db.engine.dispose()
+        shutil.rmtree(self.directorio, ignore_errors=True)
+
+    def test_leer_plan_rechaza_archivo_que_no_es_zip(self):
+        with self.assertRaisesRegex(ValueError, "dañado"):
+            list(main.leer_plan(io.BytesIO(b"esto no es un libro de Excel"), "plan.xlsx"))
+
+    def test_leer_plan_rechaza_xlsx_truncado(self):
+        contenido = _xlsx_valido()
+        with self.assertRaisesRegex(ValueError, "dañado"):
+            list(main.leer_plan(io.BytesIO(contenido[:len(contenido) // 2]), "plan.xlsx"))
+
+    def test_subida_de_xlsx_danado_muestra_mensaje(self):
+        cliente = self.app.test_client()
+        respuesta = cliente.post("/importar", data={"archivo": (io.BytesIO(b"PK\x03\x04basura"), "plan.xlsx")},
+                                 content_type="multipart/form-data", follow_redirects=True)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn("No se pudo leer el archivo", respuesta.get_data(as_text=True))
+
+    def test_comando_importar_plan_con_xlsx_danado(self):
+        ruta = os.path.join(self.directorio, "plan.xlsx")
+        with open(ruta, "wb") as f:
+            f.write(b"esto no es un libro de Excel")
+        resultado = self.app.test_cli_runner().invoke(args=["importar-plan", ruta])
+        self.assertNotEqual(resultado.exit_code, 0)
+        self.assertIn("dañado", resultado.output)
+        self.assertNotIsInstance(resultado.exception, (KeyError, OSError))
+
+
+if __name__ == "__main__":
+    unittest.main()